@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import asyncio
+import os
+
+# Threads used by the event loop for blocking work (DB sessions, article parsing, email)
+AIO_THREADS = int(os.getenv("AIO_THREADS", "32"))
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    The one event loop that runs the whole async pipeline.
+
+    It lives on its own daemon thread for the lifetime of the process, so anything
+    bound to it (HTTP clients, headless browsers, semaphores) is shared by every task
+    and cron tick, no matter which thread the work was started from.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=AIO_THREADS, thread_name_prefix="aio"))
+            threading.Thread(target=loop.run_forever, name="aio-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run(coro):
+    """
+    coro: The coroutine to run.
+    Runs it on the pipeline loop and blocks until it's done. This is how sync code calls into the async pipeline.
+    """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+
+    if running is loop:
+        coro.close()
+        raise RuntimeError("aio.run() can't be called from the pipeline loop, await the coroutine instead")
+
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
@@ -7,22 +7,16 @@ from pydantic import BaseModel
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from typing import Optional
-from passlib.context import CryptContext
 from dotenv import load_dotenv
-from sqlalchemy.exc import OperationalError
 from functools import wraps
-import time
+import asyncio
 import os
 
-from . import main
-from Backend.database.db import Base, SessionLocal, engine
-from Backend.database import models
+from . import main, cron, browser, cache, metrics, aio, jobs, worker, outbox, passwords
+from Backend.database.db import SessionLocal, engine
+from Backend.database import models, migrations
 
-from Backend.mail import send_message
-
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
-Base.metadata.create_all(bind=engine)
+migrations.run(engine)
 
 app = FastAPI()
 
@@ -35,6 +29,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Finish search generation that was cut off by a restart
+@app.on_event("startup")
+async def resume_generation():
+    with SessionLocal() as db:
+        pending = db.query(models.Task.id, models.Task.text).filter(models.Task.status == "generating").all()
+
+    loop = asyncio.get_running_loop()
+    for id, text in pending:
+        loop.run_in_executor(None, generate_searches, id, text)
+
+# Work through the cron queue inside this process too (see Backend/worker.py)
+@app.on_event("startup")
+def start_worker():
+    if worker.EMBEDDED_WORKER:
+        worker.embedded.start()
+
+# Start the password hashing processes before the first login
+@app.on_event("startup")
+def start_password_pool():
+    passwords.start()
+
+# Close the shared headless browsers and the hashing processes when the server stops
+@app.on_event("shutdown")
+def shutdown_browsers():
+    worker.embedded.stop()
+    aio.run(browser.pool.shutdown())
+    passwords.shutdown()
+
 load_dotenv()
 
 SECRET_KEY = os.getenv("JWT_SECRET", "dev_secret")
@@ -60,20 +82,25 @@ def get_api_key(api_key: str = Depends(api_key_header)):
         detail="Invalid or missing API Key",
     )
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-    )
+credentials_exception = HTTPException(
+    status_code=401,
+    detail="Could not validate credentials",
+)
+
+# For handlers that only need to know who's asking: just checks the JWT, no DB
+def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+        return int(user_id)
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    user = db.query(models.Users).filter(models.Users.userid == int(user_id)).first()
+# The user's row, from a short-lived in-process cache. Read-only: load it through `db` to change it
+def get_current_user(userid: int = Depends(get_current_user_id)):
+    user = cache.get_user(userid)
     if user is None:
         raise credentials_exception
     return user
@@ -143,17 +170,23 @@ class TaskResponse(TaskBase):
     userid: int
     id: int
     searches: list
+    status: Optional[str] = None
 
     class Config:
         orm_mode = True
 
+# Hashing runs in the password process pool, a full pool is a 429 rather than a slow API
 def get_password_hash(password):
-    if not isinstance(password, str):
-        password = str(password)
-    return pwd_context.hash(password)
+    try:
+        return passwords.hash_password(password)
+    except passwords.Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return passwords.verify_password(plain_password, hashed_password)
+    except passwords.Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
   
 # POST /create_user - add a new user
 @app.post("/create_user", status_code=201)
@@ -170,14 +203,16 @@ def create_user(user: CreateUser, db: Session = Depends(get_db)):
         reports_sent=0,
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
 
-    send_message(
+    # Sent in the background by the outbox sender, so signup doesn't wait on Gmail
+    db.add(models.Outbox(**outbox.message(
         to=user.email,
         subject=f"Welcome to Proactive AI!",
-        message_text=onboarding_message
-    )
+        body=onboarding_message,
+        kind="onboarding",
+    )))
+    db.commit()
+    db.refresh(new_user)
     
     return {"detail": "User created successfully."}
 
@@ -204,143 +239,49 @@ def user_info(current_user: models.Users = Depends(get_current_user)):
 
 # GET /user_activity - get recent activity for the current user
 @app.get("/user_activity", response_model=list[UserActivity])
-def user_activity(current_user: models.Users = Depends(get_current_user), db: Session = Depends(get_db)):
+def user_activity(userid: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
     activities = (
         db.query(models.UserActivity)
-        .filter(models.UserActivity.userid == current_user.userid)
+        .filter(models.UserActivity.userid == userid)
         .order_by(models.UserActivity.time.desc())
         .limit(10)
         .all()
     )
     return activities
 
-# POST /run_cron - call this for the cron job. Does all the backend work for cron
+# POST /run_cron - call this for the cron job. Queues the due tasks for the workers
 @app.post("/run_cron")
-def run_cron(db: Session = Depends(get_db), api_key: str = Depends(get_api_key)):
-    # Fetch tasks once
-    with SessionLocal() as db:
-        tasks = db.query(models.Task).all()
-
-    for task in tasks:
-        try:
-            id = task.id
-            userid = task.userid
-            title = task.title
-            text = task.text
-            sources = task.sources
-            searches = task.searches
-            last_cron = task.last_cron
-            last_report = task.last_report
-            contact = task.contact
-
-            contact_hours = {0: 0, 1: 12, 2: 24, 3: 48, 4: 72, 5: 96, 6: 120, 7: 168}
-            required_time = timedelta(hours=contact_hours[contact]) - timedelta(minutes=5)
-            hours_since_report = datetime.now() - last_report if last_report else timedelta.max
-            enough_time = hours_since_report >= required_time
-
-            # Fetch existing items
-            with SessionLocal() as db:
-                existing_items = db.query(models.Items).filter(models.Items.taskid == id).all()
-                existing_as_tuples = [
-                    (item.item_title, item.link, item.site_date, item.text)
-                    for item in existing_items
-                ]
-                existing_count = len(existing_as_tuples)
-                total_items = existing_count
-
-            # Long operation (no DB connection open)
-            new_items = []
-            if existing_count < sources:
-                try:
-                    new_items = main.refresh_data(text, searches, last_cron) or []
-                except Exception as e:
-                    print(f"refresh_data() failed for task {id}: {e}")
-                    new_items = []
-
-            # Reconnect for inserts
-            with SessionLocal() as db:
-                if new_items:
-                    for name, link, date, reason in new_items:
-                        new_item = models.Items(
-                            taskid=id,
-                            userid=userid,
-                            task_title=title,
-                            item_title=name,
-                            text=reason,
-                            link=link,
-                            site_date=date,
-                        )
-                        db.add(new_item)
-                    db.commit()
-                total_items = existing_count + len(new_items)
-
-            # Now re-open again for report/email logic
-            if total_items >= sources and enough_time:
-                with SessionLocal() as db:
-                    all_items = existing_as_tuples + [
-                        (i.item_title, i.link, i.site_date, i.text)
-                        for i in db.query(models.Items).filter(models.Items.taskid == id).all()
-                    ]
-                    report = main.create_report(text, all_items, last_report)
-
-                    try:
-                        email = db.query(models.Users).filter(models.Users.userid == userid).first().email
-                        send_message(
-                            to=email,
-                            subject=f'Your report on "{title}" is waiting for you!',
-                            message_text=report
-                        )
-                    except Exception as e:
-                        print(f"Email send failed for user {userid}: {e}")
-
-                    new_activity = models.UserActivity(
-                        userid=userid,
-                        action=f'Received a report for "{title}"',
-                        time=datetime.now(),
-                    )
-                    db.add(new_activity)
-
-                    db.query(models.Items).filter(models.Items.taskid == id).delete()
-
-                    db_task = db.query(models.Task).filter(models.Task.id == id).first()
-                    db_task.last_report = datetime.now()
-                    db_task.reports_sent += 1
-
-                    db_user = db.query(models.Users).filter(models.Users.userid == userid).first()
-                    db_user.reports_sent += 1
-                    db_user.last_time = datetime.now()
-
-                    db_task.last_cron = datetime.now()
-                    db.commit()
-
-        except OperationalError as e:
-            print(f"DB error on task {task.id}: {e}")
-            engine.dispose()
-            time.sleep(1)
-            continue
-
-        except Exception as e:
-            print(f"Error processing task {task.id}: {e}")
-            break
-
-    return {"detail": "All tasks ran successfully."}
+def run_cron(api_key: str = Depends(get_api_key)):
+    # Only the tasks that are due, the rest are skipped without touching their items or feeds
+    # Workers pick them up from the queue, so this returns right away
+    tasks = cron.due_tasks()
+    queued = jobs.enqueue([task.id for task in tasks])
+
+    return {
+        "detail": f"Queued {queued} of {len(tasks)} due tasks.",
+        "queued": queued,
+        "jobs": jobs.counts(),
+    }
+
+# GET /metrics - cache hit/miss counters and other internal stats for monitoring
+@app.get("/metrics")
+def get_metrics(api_key: str = Depends(get_api_key)):
+    return metrics.snapshot()
 
 # GET /get_queries - return all tasks
 @app.get("/get_queries", response_model=list[TaskResponse])
-def get_queries(current_user: models.Users = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(models.Task).filter(models.Task.userid == current_user.userid).all()
+def get_queries(userid: int = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    return db.query(models.Task).filter(models.Task.userid == userid).all()
 
 # POST /create_query - add a new task
 @app.post("/create_query", status_code=201)
-async def create_query(request: Request, db: Session = Depends(get_db), current_user: models.Users = Depends(get_current_user)):
+async def create_query(request: Request, db: Session = Depends(get_db), userid: int = Depends(get_current_user_id)):
     # Be tolerant: parse payload and coerce types so frontend can send simple JSON
     try:
         payload = await request.json()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
 
-    userid = current_user.userid
-
     title = payload.get("title")
     text = payload.get("text")
     try:
@@ -356,23 +297,30 @@ async def create_query(request: Request, db: Session = Depends(get_db), current_
     if not title or not text:
         raise HTTPException(status_code=400, detail="'title' and 'text' are required")
 
+    if contact not in cron.contact_hours:
+        raise HTTPException(status_code=400, detail="Invalid 'contact'")
+
     queries = db.query(models.Task).filter(models.Task.userid == userid).all()
     if len(queries) >= 3:
         raise HTTPException(status_code=409, detail="User already has 3 or more tasks; cannot create another.")
 
-    current_user.active_count += 1
+    db_user = db.query(models.Users).filter(models.Users.userid == userid).first()
+    if db_user is None:
+        raise credentials_exception
+    db_user.active_count += 1
 
-    searches = main.create_query(text)
+    # The searches are made in the background, the frontend polls until the task is ready
     new_task = models.Task(
         userid=userid,
         title=title,
         text=text,
         sources=sources,
-        searches=searches,
+        searches=[],
         last_cron=datetime.now(),
         last_report=datetime.fromtimestamp(0),
         contact=contact,
         reports_sent=0,
+        status="generating",
     )
     db.add(new_task)
 
@@ -385,6 +333,10 @@ async def create_query(request: Request, db: Session = Depends(get_db), current_
 
     db.commit()
     db.refresh(new_task)
+    cache.invalidate_user(userid)
+
+    # Up to 3 LLM round-trips, so it runs in the thread pool instead of blocking the event loop
+    asyncio.get_running_loop().run_in_executor(None, generate_searches, new_task.id, text)
 
     # Return the created task object (frontend expects the new item)
     return {
@@ -397,27 +349,68 @@ async def create_query(request: Request, db: Session = Depends(get_db), current_
         "contact": new_task.contact,
         "last_cron": new_task.last_cron,
         "last_report": new_task.last_report,
+        "status": new_task.status,
     }
 
+# Makes the RSS searches of a new task and marks it ready (or failed), runs in the background
+def generate_searches(id: int, text: str):
+    try:
+        searches = main.create_query(text)
+    except Exception as e:
+        print(f"Search generation failed for task {id}: {e}")
+        searches = []
+
+    try:
+        with SessionLocal() as db:
+            db_task = db.query(models.Task).filter(models.Task.id == id).first()
+            # Deleted while the searches were being made
+            if not db_task:
+                return
+
+            db_task.searches = searches
+            db_task.status = "ready" if searches else "failed"
+            db.commit()
+        return
+    except Exception as e:
+        # Nobody awaits this, so an error here would leave the task "generating" (and the frontend polling) for good
+        print(f"Saving the searches of task {id} failed: {e}")
+
+    try:
+        with SessionLocal() as db:
+            db.query(models.Task).filter(models.Task.id == id).update({models.Task.status: "failed"})
+            db.commit()
+    except Exception as e:
+        print(f"Couldn't mark task {id} as failed: {e}")
+
 # PUT /update_query/:id - update an existing task
 @app.put("/update_query/{id}", status_code=200)
-def update_query(id: int, task: TaskUpdate, db: Session = Depends(get_db), current_user: models.Users = Depends(get_current_user)):
+def update_query(id: int, task: TaskUpdate, db: Session = Depends(get_db), userid: int = Depends(get_current_user_id)):
     db_task = db.query(models.Task).filter(models.Task.id == id).first()
     if not db_task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if db_task.userid != current_user.userid:
+    if db_task.userid != userid:
         raise HTTPException(status_code=403, detail="Not your task")
 
+    if task.contact is not None and task.contact not in cron.contact_hours:
+        raise HTTPException(status_code=400, detail="Invalid 'contact'")
+
     if task.title is not None:
         db_task.title = task.title
-    if task.text is not None:
+    if task.text is not None and task.text != db_task.text:
         db_task.text = task.text
+
+        # Whatever the old query rejected gets another look against the new one
+        db.query(models.SeenItems).filter(models.SeenItems.taskid == id).delete()
+        db.query(models.FeedState).filter(models.FeedState.taskid == id).delete()
     if task.sources is not None:
         db_task.sources = task.sources
     if task.contact is not None:
         db_task.contact = task.contact
 
+    # Reschedule with the new settings on the next tick
+    db_task.next_refresh_at = None
+
     new_activity = models.UserActivity(
         userid=db_task.userid,
         action=f"Updated task \"{task.title}\"",
@@ -439,19 +432,24 @@ def update_query(id: int, task: TaskUpdate, db: Session = Depends(get_db), curre
 
 # DELETE /delete_query/:id - delete a task
 @app.delete("/delete_query/{id}", status_code=200)
-def delete_query(id: int, db: Session = Depends(get_db), current_user: models.Users = Depends(get_current_user)):
+def delete_query(id: int, db: Session = Depends(get_db), userid: int = Depends(get_current_user_id)):
     db_task = db.query(models.Task).filter(models.Task.id == id).first()
     if not db_task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if db_task.userid != current_user.userid:
+    if db_task.userid != userid:
         raise HTTPException(status_code=403, detail="Not your task")
-    
-    if current_user.active_count > 0:
-        current_user.active_count -= 1
+
+    db_user = db.query(models.Users).filter(models.Users.userid == userid).first()
+    if db_user and db_user.active_count > 0:
+        db_user.active_count -= 1
 
     # Delete all related items first
     db.query(models.Items).filter(models.Items.taskid == id).delete()
+    db.query(models.TaskEmbeddings).filter(models.TaskEmbeddings.taskid == id).delete()
+    db.query(models.SeenItems).filter(models.SeenItems.taskid == id).delete()
+    db.query(models.FeedState).filter(models.FeedState.taskid == id).delete()
+    db.query(models.CronJobs).filter(models.CronJobs.taskid == id).delete()
 
     new_activity = models.UserActivity(
         userid=db_task.userid,
@@ -463,4 +461,5 @@ def delete_query(id: int, db: Session = Depends(get_db), current_user: models.Us
     # Then delete the task itself
     db.delete(db_task)
     db.commit()
+    cache.invalidate_user(userid)
     return {"detail": "Task and related items deleted successfully."}
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Latency of the hot queries before and after the indexes in `models`.
+
+    python -m Backend.benchmarks.db_indexes [rows]
+
+Fills a throwaway SQLite database with `rows` items and activity rows (default 200k),
+times each query without the indexes, runs the migrations, and times them again.
+Set DATABASE_URL to point it at another (empty!) database instead.
+"""
+from datetime import datetime, timedelta
+import statistics
+import tempfile
+import random
+import time
+import sys
+import os
+
+# The engine is created on import, so the URL has to be set first
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+from sqlalchemy import inspect
+
+from Backend.database.db import Base, SessionLocal, engine
+from Backend.database import models, migrations
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+USERS = 2_000
+TASKS = 10_000
+REPEAT = 50
+
+
+def seed():
+    random.seed(0)
+    start = datetime.now() - timedelta(days=365)
+
+    tasks = [
+        {
+            "id": i + 1, "userid": random.randint(1, USERS), "title": f"Task {i}", "text": "query",
+            "sources": 5, "searches": [], "last_cron": start, "last_report": start, "contact": 1, "reports_sent": 0,
+        }
+        for i in range(TASKS)
+    ]
+    items = [
+        {
+            "taskid": random.randint(1, TASKS), "userid": 1, "task_title": "Task", "item_title": f"Item {i}",
+            "text": "reason", "link": f"https://example.com/{i}", "site_date": start,
+        }
+        for i in range(ROWS)
+    ]
+    activity = [
+        {"userid": random.randint(1, USERS), "action": "Created a query", "time": start + timedelta(seconds=i * 60)}
+        for i in range(ROWS)
+    ]
+
+    with SessionLocal() as db:
+        db.bulk_insert_mappings(models.Task, tasks)
+        db.bulk_insert_mappings(models.Items, items)
+        db.bulk_insert_mappings(models.UserActivity, activity)
+        db.commit()
+
+
+def drop_indexes():
+    # Back to the old schema: only the primary key indexes
+    for table in (models.Task, models.Items, models.UserActivity):
+        for index in table.__table__.indexes:
+            if index.name in {i["name"] for i in inspect(engine).get_indexes(table.__tablename__)}:
+                if [c.name for c in index.columns] != ["id"]:
+                    index.drop(bind=engine)
+
+
+queries = {
+    # cron: load_items / TickWrites
+    "items by taskid": lambda db, r: db.query(models.Items).filter(models.Items.taskid == r.randint(1, TASKS)).all(),
+    # get_queries, create_query
+    "tasks by userid": lambda db, r: db.query(models.Task).filter(models.Task.userid == r.randint(1, USERS)).all(),
+    # /user_activity
+    "latest activity": lambda db, r: (
+        db.query(models.UserActivity)
+        .filter(models.UserActivity.userid == r.randint(1, USERS))
+        .order_by(models.UserActivity.time.desc())
+        .limit(10)
+        .all()
+    ),
+}
+
+
+def measure():
+    results = {}
+    r = random.Random(1)
+    with SessionLocal() as db:
+        for name, query in queries.items():
+            timings = []
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                query(db, r)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = statistics.median(timings)
+    return results
+
+
+if __name__ == "__main__":
+    if inspect(engine).has_table("items"):
+        sys.exit("DATABASE_URL already has tables, use an empty database")
+
+    Base.metadata.create_all(bind=engine)
+    drop_indexes()
+
+    print(f"Seeding {ROWS} items and activity rows, {TASKS} tasks...")
+    seed()
+
+    before = measure()
+    migrations.run(engine)
+    after = measure()
+
+    print()
+    print(f"{'query':<20}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name in queries:
+        print(f"{name:<20}{before[name]:>14.3f}{after[name]:>14.3f}{before[name] / after[name]:>9.0f}x")
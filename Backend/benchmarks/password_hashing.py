@@ -0,0 +1,84 @@
+"""
+Login throughput at the configured argon2 parameters.
+
+    python -m Backend.benchmarks.password_hashing [seconds]
+
+Times password verification on one core, then through the password process pool
+(HASH_PROCESSES processes), and reports logins/sec and logins/sec per core. Finally
+floods the pool to check that requests past HASH_MAX_PENDING are rejected, not queued.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import time
+import sys
+import os
+
+from Backend import passwords
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+
+def serial(hashed: str) -> float:
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < SECONDS:
+        passwords._verify("correct horse battery staple", hashed)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def pooled(hashed: str) -> float:
+    # Just enough callers to keep every process busy without hitting the pending limit
+    callers = min(passwords.HASH_MAX_PENDING, passwords.HASH_PROCESSES * 2)
+    count = 0
+    deadline = time.perf_counter() + SECONDS
+
+    def caller():
+        nonlocal count
+        while time.perf_counter() < deadline:
+            passwords.verify_password("correct horse battery staple", hashed)
+            count += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(callers) as pool:
+        for future in [pool.submit(caller) for _ in range(callers)]:
+            future.result()
+    return count / (time.perf_counter() - start)
+
+
+def flood(hashed: str):
+    accepted = rejected = 0
+
+    def attempt():
+        nonlocal accepted, rejected
+        try:
+            passwords.verify_password("correct horse battery staple", hashed)
+            accepted += 1
+        except passwords.Overloaded:
+            rejected += 1
+
+    burst = passwords.HASH_MAX_PENDING * 3
+    with ThreadPoolExecutor(burst) as pool:
+        for future in [pool.submit(attempt) for _ in range(burst)]:
+            future.result()
+    return burst, accepted, rejected
+
+
+if __name__ == "__main__":
+    handler = passwords.pwd_context.handler("argon2")
+    print(f"argon2{handler.type}: memory_cost={handler.memory_cost} KiB, time_cost={handler.default_rounds}, parallelism={handler.parallelism}")
+    print(f"HASH_PROCESSES={passwords.HASH_PROCESSES}, HASH_MAX_PENDING={passwords.HASH_MAX_PENDING}, cpus={os.cpu_count()}")
+
+    hashed = passwords._hash("correct horse battery staple")
+
+    one_core = serial(hashed)
+    print(f"\none core:  {one_core:.1f} logins/sec ({1000 / one_core:.1f} ms each)")
+
+    passwords.start()
+    total = pooled(hashed)
+    cores = min(passwords.HASH_PROCESSES, os.cpu_count() or 1)
+    print(f"pool:      {total:.1f} logins/sec ({total / cores:.1f} per core)")
+
+    burst, accepted, rejected = flood(hashed)
+    print(f"burst of {burst}: {accepted} served, {rejected} rejected with 429")
+
+    passwords.shutdown()
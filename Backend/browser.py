@@ -0,0 +1,142 @@
+from playwright.async_api import async_playwright, Error as PlaywrightError
+import contextlib
+import urllib.parse
+import asyncio
+import os
+
+from Backend import cache, aio
+
+# Number of browsers kept alive, and how many navigations each browser does before it's relaunched
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_NAVIGATIONS = int(os.getenv("BROWSER_MAX_NAVIGATIONS", "100"))
+
+
+class _Slot:
+    def __init__(self):
+        self.browser = None
+        self.navigations = 0
+
+
+class BrowserPool:
+    """
+    Long-lived headless Chromium browsers shared by every task and cron tick.
+
+    The browsers belong to the pipeline loop (see Backend/aio.py), which lives as long
+    as the process, so they survive between ticks. Each `page()` borrows one browser
+    and gets a fresh context (so no cookies or state leak between items). Browsers are
+    relaunched after `max_navigations` pages or after a Playwright failure.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_navigations: int = BROWSER_MAX_NAVIGATIONS):
+        self.size = max(1, size)
+        self.max_navigations = max(1, max_navigations)
+        self._playwright = None
+        self._slots = None
+        self._all = []
+        self._lock = asyncio.Lock()
+
+    async def _start(self):
+        async with self._lock:
+            if self._slots is not None:
+                return
+            self._playwright = await async_playwright().start()
+            self._slots = asyncio.Queue()
+            self._all = [_Slot() for _ in range(self.size)]
+            for slot in self._all:
+                self._slots.put_nowait(slot)
+
+    @staticmethod
+    async def _close(slot):
+        try:
+            if slot.browser:
+                await slot.browser.close()
+        except Exception:
+            pass
+        slot.browser = None
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        await self._start()
+        slot = await self._slots.get()
+        context = None
+
+        try:
+            # Recycle the browser after enough navigations, or if it died
+            if slot.browser and (slot.navigations >= self.max_navigations or not slot.browser.is_connected()):
+                await self._close(slot)
+
+            if slot.browser is None:
+                slot.browser = await self._playwright.chromium.launch(headless=True)
+                slot.navigations = 0
+
+            slot.navigations += 1
+            context = await slot.browser.new_context()
+            yield await context.new_page()
+
+        except PlaywrightError:
+            # Don't trust the browser after a Playwright failure
+            await self._close(slot)
+            raise
+
+        finally:
+            if context:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+            self._slots.put_nowait(slot)
+
+    async def shutdown(self):
+        async with self._lock:
+            for slot in self._all:
+                await self._close(slot)
+            if self._playwright:
+                await self._playwright.stop()
+            self._playwright = None
+            self._slots = None
+            self._all = []
+
+
+pool = BrowserPool()
+
+
+def is_google_news(url: str) -> bool:
+    host = urllib.parse.urlparse(url).netloc.lower()
+    return host == "news.google.com" or host.endswith(".news.google.com")
+
+
+async def _resolve(url: str) -> str:
+    async with pool.page() as page:
+        try:
+            await page.goto(url, wait_until="domcontentloaded", timeout=7000)
+            try:
+                await page.wait_for_load_state("networkidle", timeout=5000)
+            except Exception:
+                pass
+            return await page.evaluate("window.location.href")
+        except Exception as e:
+            return f"ERROR: navigation failed ({e})"
+
+
+# Google News is annoying. This gets the actual URL instead of Google's redirect
+async def resolve_url_async(url: str) -> str:
+    # Already a real article link, nothing to resolve
+    if not is_google_news(url):
+        return url
+
+    cached = await asyncio.to_thread(cache.get_resolved_url, url)
+    if cached:
+        return cached
+
+    try:
+        final_url = await _resolve(url)
+        await asyncio.to_thread(cache.store_resolved_url, url, final_url)
+        return final_url
+    except PlaywrightError as e:
+        return f"ERROR: Playwright failed ({e})"
+    except Exception as e:
+        return f"ERROR: unexpected failure ({e})"
+
+
+def resolve_url(url: str) -> str:
+    return aio.run(resolve_url_async(url))
@@ -0,0 +1,482 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Optional
+import urllib.parse
+import threading
+import asyncio
+import hashlib
+import time
+import json
+import os
+
+from Backend.database.db import SessionLocal
+from Backend.database import models
+from Backend import metrics, vectors
+
+# Resolved Google News links basically never change, so keep them for a long time
+URL_CACHE_TTL_HOURS = int(os.getenv("URL_CACHE_TTL_HOURS", str(24 * 30)))
+URL_CACHE_MAX_ROWS = int(os.getenv("URL_CACHE_MAX_ROWS", "50000"))
+
+# Article text is re-extracted after a while, and the whole store is capped by total text size
+ARTICLE_CACHE_TTL_HOURS = int(os.getenv("ARTICLE_CACHE_TTL_HOURS", str(24 * 7)))
+ARTICLE_CACHE_MAX_MB = int(os.getenv("ARTICLE_CACHE_MAX_MB", "200"))
+
+# LLM response cache is opt-in, since it makes identical prompts return identical answers
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "0") == "1"
+LLM_CACHE_TTL_HOURS = int(os.getenv("LLM_CACHE_TTL_HOURS", "24"))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "100"))
+
+# How long an authenticated user's row is reused before it's read from the DB again
+# Writes in this process invalidate it right away, writes from other worker processes show up within this time
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+# How long a task remembers which links it already evaluated
+SEEN_RETENTION_DAYS = int(os.getenv("SEEN_RETENTION_DAYS", "14"))
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {"fbclid", "gclid", "ocid", "cmpid", "ref", "mc_cid", "mc_eid", "guccounter"}
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def evict_over_size(db, table, key, max_mb: int) -> int:
+    """
+    Deletes the least recently used rows of `table` once the total of its `size` column goes over `max_mb`.
+    """
+    # Running total of sizes, newest first. Everything past the cap gets evicted
+    running = (
+        select(key.label("key"), func.sum(table.size).over(order_by=table.last_used.desc()).label("total"))
+        .subquery()
+    )
+    overflow = select(running.c.key).where(running.c.total > max_mb * 1024 * 1024)
+    return db.query(table).filter(key.in_(overflow)).delete(synchronize_session=False)
+
+
+##########################
+#   Resolved URL cache   #
+##########################
+
+
+def get_resolved_url(url: str) -> Optional[str]:
+    """
+    url: The Google News redirect link.
+    Returns the final URL if it was resolved before (and hasn't expired), else None.
+    """
+    now = datetime.now()
+    try:
+        with SessionLocal() as db:
+            row = db.get(models.ResolvedUrls, sha256(url))
+            if row is None or row.created < now - timedelta(hours=URL_CACHE_TTL_HOURS):
+                metrics.incr("url_cache.miss")
+                return None
+
+            # Touch it so the LRU eviction keeps it around
+            row.last_used = now
+            db.commit()
+            metrics.incr("url_cache.hit")
+            return row.final_url
+    except Exception as e:
+        print(f"URL cache lookup failed: {e}")
+        metrics.incr("url_cache.error")
+        return None
+
+
+def store_resolved_url(url: str, final_url: str):
+    # Never cache failures, they should be retried next time
+    if not final_url or final_url.startswith("ERROR:"):
+        return
+
+    now = datetime.now()
+    try:
+        with SessionLocal() as db:
+            db.merge(models.ResolvedUrls(
+                url_hash=sha256(url),
+                url=url,
+                final_url=final_url,
+                created=now,
+                last_used=now,
+            ))
+            db.commit()
+    except IntegrityError:
+        # Another worker stored the same link at the same time
+        pass
+    except Exception as e:
+        print(f"URL cache store failed: {e}")
+        metrics.incr("url_cache.error")
+
+
+def prune_resolved_urls():
+    """
+    Drops expired links, then the least recently used ones above URL_CACHE_MAX_ROWS.
+    """
+    table = models.ResolvedUrls
+    cutoff = datetime.now() - timedelta(hours=URL_CACHE_TTL_HOURS)
+
+    with SessionLocal() as db:
+        expired = db.query(table).filter(table.created < cutoff).delete(synchronize_session=False)
+
+        overflow = (
+            select(table.url_hash)
+            .order_by(table.last_used.desc())
+            .offset(URL_CACHE_MAX_ROWS)
+        )
+        evicted = db.query(table).filter(table.url_hash.in_(overflow)).delete(synchronize_session=False)
+        db.commit()
+
+    metrics.incr("url_cache.expired", expired)
+    metrics.incr("url_cache.evicted", evicted)
+
+
+#####################
+#   Article store   #
+#####################
+
+
+def canonical_url(url: str) -> str:
+    """
+    url: Any article URL.
+    Lowercases the host, drops the fragment and tracking parameters, and sorts the rest,
+    so the same article shared through different links maps to one key.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    query = [
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    ]
+    path = parts.path.rstrip("/") or "/"
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        path,
+        urllib.parse.urlencode(sorted(query)),
+        "",
+    ))
+
+
+def get_article(url: str) -> Optional[str]:
+    """
+    url: The resolved article URL.
+    Returns the stored article text if it was extracted recently, else None.
+    """
+    now = datetime.now()
+    try:
+        with SessionLocal() as db:
+            row = db.get(models.Articles, sha256(canonical_url(url)))
+            if row is None or row.extracted < now - timedelta(hours=ARTICLE_CACHE_TTL_HOURS):
+                metrics.incr("article_cache.miss")
+                return None
+
+            row.last_used = now
+            db.commit()
+            metrics.incr("article_cache.hit")
+            return row.text
+    except Exception as e:
+        print(f"Article cache lookup failed: {e}")
+        metrics.incr("article_cache.error")
+        return None
+
+
+def store_article(url: str, text: str):
+    if text is None or text.startswith("ERROR:"):
+        return
+
+    now = datetime.now()
+    canonical = canonical_url(url)
+    try:
+        with SessionLocal() as db:
+            db.merge(models.Articles(
+                url_hash=sha256(canonical),
+                url=canonical,
+                text=text,
+                content_hash=sha256(text),
+                size=len(text.encode("utf-8")),
+                extracted=now,
+                last_used=now,
+            ))
+            db.commit()
+    except IntegrityError:
+        pass
+    except Exception as e:
+        print(f"Article cache store failed: {e}")
+        metrics.incr("article_cache.error")
+
+
+# One lock per article being fetched right now, so concurrent tasks wait for each other instead of downloading twice
+_inflight = {}
+
+
+async def get_or_fetch_article(url: str, fetch) -> str:
+    """
+    url: The resolved article URL.
+    fetch: Awaited as fetch(url) to download and extract the text on a miss.
+    """
+    key = canonical_url(url)
+    lock = _inflight.setdefault(key, asyncio.Lock())
+
+    try:
+        async with lock:
+            text = await asyncio.to_thread(get_article, url)
+            if text is None:
+                text = await fetch(url)
+                await asyncio.to_thread(store_article, url, text)
+            return text
+    finally:
+        if _inflight.get(key) is lock and not lock.locked():
+            del _inflight[key]
+
+
+def prune_articles():
+    """
+    Drops stale articles, then the least recently used ones once the store is over ARTICLE_CACHE_MAX_MB.
+    """
+    table = models.Articles
+    cutoff = datetime.now() - timedelta(hours=ARTICLE_CACHE_TTL_HOURS)
+
+    with SessionLocal() as db:
+        expired = db.query(table).filter(table.extracted < cutoff).delete(synchronize_session=False)
+
+        evicted = evict_over_size(db, table, table.url_hash, ARTICLE_CACHE_MAX_MB)
+        db.commit()
+
+    metrics.incr("article_cache.expired", expired)
+    metrics.incr("article_cache.evicted", evicted)
+
+
+##########################
+#   LLM response cache   #
+##########################
+
+
+def llm_key(model: str, messages: list, tools: list) -> str:
+    return sha256(json.dumps({"model": model, "messages": messages, "tools": tools}, sort_keys=True))
+
+
+def get_llm_response(key: str):
+    """
+    key: From `llm_key`.
+    Returns the cached (message, tool_name, tool_contents), or None.
+    """
+    now = datetime.now()
+    try:
+        with SessionLocal() as db:
+            row = db.get(models.LlmCache, key)
+            if row is None or row.created < now - timedelta(hours=LLM_CACHE_TTL_HOURS):
+                metrics.incr("llm_cache.miss")
+                return None
+
+            row.last_used = now
+            db.commit()
+
+            # What the hit saved
+            metrics.incr("llm_cache.hit")
+            metrics.incr("llm_cache.saved_tokens", row.tokens)
+            metrics.incr("llm_cache.saved_ms", row.latency_ms)
+            return tuple(row.response)
+    except Exception as e:
+        print(f"LLM cache lookup failed: {e}")
+        metrics.incr("llm_cache.error")
+        return None
+
+
+def store_llm_response(key: str, model: str, response: tuple, tokens: int, latency_ms: int):
+    now = datetime.now()
+    try:
+        with SessionLocal() as db:
+            db.merge(models.LlmCache(
+                key=key,
+                model=model,
+                response=list(response),
+                tokens=tokens,
+                latency_ms=latency_ms,
+                size=len(json.dumps(list(response))),
+                created=now,
+                last_used=now,
+            ))
+            db.commit()
+    except IntegrityError:
+        pass
+    except Exception as e:
+        print(f"LLM cache store failed: {e}")
+        metrics.incr("llm_cache.error")
+
+
+def prune_llm_responses():
+    table = models.LlmCache
+    cutoff = datetime.now() - timedelta(hours=LLM_CACHE_TTL_HOURS)
+
+    with SessionLocal() as db:
+        expired = db.query(table).filter(table.created < cutoff).delete(synchronize_session=False)
+        evicted = evict_over_size(db, table, table.key, LLM_CACHE_MAX_MB)
+        db.commit()
+
+    metrics.incr("llm_cache.expired", expired)
+    metrics.incr("llm_cache.evicted", evicted)
+
+
+#######################
+#   Task embeddings   #
+#######################
+
+
+def get_task_vectors(taskid: int, user_query: str, searches: list):
+    """
+    taskid: The task (None to skip storing).
+    Returns the embedding matrix of the task text and searches, computing and storing it the first time
+    (or when the text or searches changed).
+    """
+    texts = [user_query] + list(searches or [])
+    source_hash = sha256(json.dumps(texts))
+
+    if taskid is None:
+        return vectors.embed(texts)
+
+    try:
+        with SessionLocal() as db:
+            row = db.get(models.TaskEmbeddings, taskid)
+            if row and row.source_hash == source_hash and row.dim == vectors.EMBED_DIM:
+                return vectors.from_bytes(row.vectors)
+
+            matrix = vectors.embed(texts)
+            db.merge(models.TaskEmbeddings(
+                taskid=taskid,
+                source_hash=source_hash,
+                dim=vectors.EMBED_DIM,
+                vectors=vectors.to_bytes(matrix),
+                created=datetime.now(),
+            ))
+            db.commit()
+            return matrix
+    except Exception as e:
+        print(f"Task embedding lookup failed: {e}")
+        return vectors.embed(texts)
+
+
+#########################
+#   Seen items ledger   #
+#########################
+
+
+def get_seen_links(taskid: int, links: list) -> set:
+    """
+    taskid: The task.
+    links: RSS links about to be evaluated.
+    Returns the links this task already evaluated in an earlier run.
+    """
+    if taskid is None or not links:
+        return set()
+
+    hashes = {sha256(link): link for link in links}
+    table = models.SeenItems
+
+    try:
+        with SessionLocal() as db:
+            rows = db.query(table.link_hash).filter(
+                table.taskid == taskid,
+                table.link_hash.in_(list(hashes)),
+            ).all()
+    except Exception as e:
+        print(f"Seen items lookup failed: {e}")
+        metrics.incr("seen_items.error")
+        return set()
+
+    seen = {hashes[h] for (h,) in rows}
+    metrics.incr("seen_items.hit", len(seen))
+    metrics.incr("seen_items.miss", len(hashes) - len(seen))
+    return seen
+
+
+def mark_seen(taskid: int, links: list):
+    if taskid is None or not links:
+        return
+
+    now = datetime.now()
+    try:
+        with SessionLocal() as db:
+            for link in set(links):
+                db.merge(models.SeenItems(taskid=taskid, link_hash=sha256(link), seen=now))
+            db.commit()
+    except Exception as e:
+        print(f"Seen items store failed: {e}")
+        metrics.incr("seen_items.error")
+
+
+def add_seen(db, taskid: int, links: list):
+    """
+    Same as `mark_seen`, but in the caller's transaction, so the links only count as seen once whatever came of them is committed too.
+    """
+    if taskid is None or not links:
+        return
+
+    now = datetime.now()
+    rows = [{"taskid": taskid, "link_hash": sha256(link), "seen": now} for link in set(links)]
+
+    # Links seen again (a retried tick) keep their row
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(models.SeenItems.__table__).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        statement = sqlite.insert(models.SeenItems.__table__).on_conflict_do_nothing()
+    else:
+        for row in rows:
+            db.merge(models.SeenItems(**row))
+        return
+    db.execute(statement, rows)
+
+
+def prune_seen_items():
+    table = models.SeenItems
+    cutoff = datetime.now() - timedelta(days=SEEN_RETENTION_DAYS)
+
+    with SessionLocal() as db:
+        expired = db.query(table).filter(table.seen < cutoff).delete(synchronize_session=False)
+        db.commit()
+
+    metrics.incr("seen_items.expired", expired)
+
+
+##################
+#   User cache   #
+##################
+
+
+_users = {}
+_users_lock = threading.Lock()
+
+
+def get_user(userid: int):
+    """
+    userid: The user to look up.
+    Returns the user's row (detached from any session, so treat it as read-only), or None if there's no such user.
+    """
+    now = time.monotonic()
+    with _users_lock:
+        entry = _users.get(userid)
+    if entry and entry[0] > now:
+        metrics.incr("user_cache.hit")
+        return entry[1]
+
+    metrics.incr("user_cache.miss")
+    with SessionLocal() as db:
+        user = db.get(models.Users, userid)
+
+    if user is not None:
+        with _users_lock:
+            _users[userid] = (now + USER_CACHE_TTL_SECONDS, user)
+    return user
+
+
+def invalidate_user(*userids: int):
+    with _users_lock:
+        for userid in userids:
+            _users.pop(userid, None)
+
+
+def prune():
+    prune_resolved_urls()
+    prune_articles()
+    prune_llm_responses()
+    prune_seen_items()
@@ -0,0 +1,380 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, delete, or_
+from sqlalchemy.exc import OperationalError
+import asyncio
+import random
+import time
+import os
+
+from . import main, cache, metrics, aio, outbox
+from Backend.feeds import FeedRegistry
+from Backend.database.db import SessionLocal, engine
+from Backend.database import models
+
+# How many tasks are processed at the same time during one cron tick
+CRON_CONCURRENCY = int(os.getenv("CRON_CONCURRENCY", "4"))
+
+# Maps the `contact` setting of a task to the hours between reports
+contact_hours = {0: 0, 1: 12, 2: 24, 3: 48, 4: 72, 5: 96, 6: 120, 7: 168}
+
+
+def report_hours(contact) -> int:
+    # Tasks saved before `contact` was validated can hold anything, treat those like the default
+    return contact_hours.get(contact, contact_hours[0])
+
+# How often a task's feeds are polled while it still needs items
+# Every wake-up time is pushed back by a random share of this, so tasks created together drift apart
+REFRESH_INTERVAL_MINUTES = int(os.getenv("REFRESH_INTERVAL_MINUTES", "60"))
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0.2"))
+
+# Most due tasks picked up by one tick, the rest stay due and go first next tick
+CRON_MAX_TASKS = int(os.getenv("CRON_MAX_TASKS", "200"))
+
+
+def due_tasks(limit: int = CRON_MAX_TASKS):
+    """
+    Returns the tasks whose next refresh is due, longest overdue first (new tasks before everything else).
+    """
+    now = datetime.now()
+    with SessionLocal() as db:
+        return (
+            db.query(models.Task)
+            .filter(or_(models.Task.next_refresh_at.is_(None), models.Task.next_refresh_at <= now))
+            .filter(or_(models.Task.status.is_(None), models.Task.status == "ready"))
+            .order_by(models.Task.next_refresh_at.asc().nulls_first(), models.Task.id)
+            .limit(limit)
+            .all()
+        )
+
+
+def schedule(task, has_enough_items: bool, reported: bool):
+    """
+    task: The task that just ran.
+    has_enough_items: It has enough items for a report, and is only waiting for the report to be due.
+    reported: It sent a report this tick.
+    Returns when the task should next run, and when its next report is due.
+    """
+    now = datetime.now()
+    last_report = now if reported else task.last_report
+    next_report_at = last_report + timedelta(hours=report_hours(task.contact)) - timedelta(minutes=5)
+
+    jitter = timedelta(minutes=random.uniform(0, SCHEDULE_JITTER * REFRESH_INTERVAL_MINUTES))
+    if has_enough_items and not reported:
+        # Nothing to fetch, sleep until the report is due
+        next_refresh_at = max(next_report_at, now) + jitter
+    else:
+        next_refresh_at = now + timedelta(minutes=REFRESH_INTERVAL_MINUTES) + jitter
+
+    return {"id": task.id, "next_refresh_at": next_refresh_at, "next_report_at": next_report_at}
+
+
+# Blocking DB steps, run in the loop's thread pool so they don't stall the other tasks
+# Each one is a fixed number of queries for the whole tick, no matter how many tasks there are
+
+def load_items(task_ids):
+    """
+    Returns the pending items of every task, as `{taskid: [(title, link, date, reason, alternates), ...]}`.
+    """
+    items = {id: [] for id in task_ids}
+    if not items:
+        return items
+
+    with SessionLocal() as db:
+        rows = (
+            db.query(models.Items)
+            .filter(models.Items.taskid.in_(list(items)))
+            .order_by(models.Items.id)
+            .all()
+        )
+        for item in rows:
+            items[item.taskid].append((item.item_title, item.link, item.site_date, item.text, item.alternates or []))
+    return items
+
+
+def load_emails(userids):
+    if not userids:
+        return {}
+
+    with SessionLocal() as db:
+        rows = db.query(models.Users.userid, models.Users.email).filter(models.Users.userid.in_(list(userids))).all()
+        return dict(rows)
+
+
+class TickWrites:
+    """
+    Every DB write of one tick, collected while the tasks run and applied together at the end.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.reported = []
+        self.emails = []
+        self.schedules = []
+        self.seen = []
+        self.feed_states = []
+
+    def add_seen(self, task, links, feed_states=()):
+        if links:
+            self.seen.append((task.id, links))
+        self.feed_states.extend(feed_states)
+
+    def add_items(self, task, new_items, seen_links=(), feed_states=()):
+        self.add_seen(task, seen_links, feed_states)
+        for name, link, date, reason, alternates in new_items:
+            self.items.append({
+                "taskid": task.id,
+                "userid": task.userid,
+                "task_title": task.title,
+                "item_title": name,
+                "text": reason,
+                "link": link,
+                "site_date": date,
+                "alternates": alternates,
+            })
+
+    def add_report(self, task, email: str, report: str, seen_links=(), feed_states=()):
+        self.add_seen(task, seen_links, feed_states)
+        self.reported.append(task)
+        if email:
+            self.emails.append((task.id, outbox.message(
+                to=email,
+                subject=f'Your report on "{task.title}" is waiting for you!',
+                body=report,
+                kind="report",
+            )))
+        else:
+            print(f"No email address for user {task.userid}")
+
+    def add_schedule(self, task, has_enough_items: bool = False, reported: bool = False):
+        self.schedules.append(schedule(task, has_enough_items, reported))
+
+    def _apply(self, db, items, reported, emails, schedules, seen, feed_states):
+        now = datetime.now()
+
+        if items:
+            db.execute(insert(models.Items), items)
+
+        # Marked seen together with the items (or report) they became
+        for taskid, links in seen:
+            cache.add_seen(db, taskid, links)
+
+        # Same for the validators of the feeds they came from
+        for row in feed_states:
+            db.merge(models.FeedState(**row))
+
+        # Bulk update by primary key (one executemany)
+        if schedules:
+            db.execute(update(models.Task), schedules)
+
+        if not reported:
+            return
+
+        task_ids = [task.id for task in reported]
+
+        db.execute(insert(models.UserActivity), [
+            {"userid": task.userid, "action": f'Received a report for "{task.title}"', "time": now}
+            for task in reported
+        ])
+
+        # Queued in the same transaction as the report, so it's sent exactly when the report is recorded
+        if emails:
+            db.execute(insert(models.Outbox), emails)
+
+        # The items went into the report
+        db.execute(delete(models.Items).where(models.Items.taskid.in_(task_ids)))
+
+        db.execute(
+            update(models.Task)
+            .where(models.Task.id.in_(task_ids))
+            .values(last_report=now, last_cron=now, reports_sent=models.Task.reports_sent + 1)
+        )
+
+        # One statement per distinct count, almost always just one
+        reports_per_user = Counter(task.userid for task in reported)
+        by_count = defaultdict(list)
+        for userid, count in reports_per_user.items():
+            by_count[count].append(userid)
+
+        for count, userids in by_count.items():
+            db.execute(
+                update(models.Users)
+                .where(models.Users.userid.in_(userids))
+                .values(reports_sent=models.Users.reports_sent + count, last_time=now)
+            )
+
+    def apply(self):
+        if not self.items and not self.reported and not self.schedules and not self.seen and not self.feed_states:
+            return
+
+        try:
+            with SessionLocal() as db:
+                self._apply(db, self.items, self.reported, [row for _, row in self.emails], self.schedules, self.seen, self.feed_states)
+                db.commit()
+            cache.invalidate_user(*{task.userid for task in self.reported})
+            return
+        except Exception as e:
+            print(f"Bulk write failed ({e}), writing each task on its own")
+
+        # So one bad task doesn't lose the writes of every other task
+        for task_id in {row["id"] for row in self.schedules} | {row["taskid"] for row in self.items} | {task.id for task in self.reported} | {id for id, _ in self.seen} | {row["taskid"] for row in self.feed_states}:
+            try:
+                with SessionLocal() as db:
+                    self._apply(
+                        db,
+                        [row for row in self.items if row["taskid"] == task_id],
+                        [task for task in self.reported if task.id == task_id],
+                        [row for id, row in self.emails if id == task_id],
+                        [row for row in self.schedules if row["id"] == task_id],
+                        [(id, links) for id, links in self.seen if id == task_id],
+                        [row for row in self.feed_states if row["taskid"] == task_id],
+                    )
+                    db.commit()
+                cache.invalidate_user(*{task.userid for task in self.reported if task.id == task_id})
+            except Exception as e:
+                print(f"Write failed for task {task_id}: {e}")
+
+
+async def process_task(task, existing_items: list, email: str, writes: TickWrites, registry=None):
+    """
+    task: The task to refresh and (if it's time) report on.
+    existing_items: Its items from earlier ticks.
+    email: Where to send the report.
+    writes: Collects the DB changes of the whole tick.
+    registry: Feed registry shared by the whole tick.
+    Returns a summary of what happened.
+    """
+    id = task.id
+    userid = task.userid
+    title = task.title
+    text = task.text
+    sources = task.sources
+    searches = task.searches
+    last_cron = task.last_cron
+    last_report = task.last_report
+    contact = task.contact
+
+    required_time = timedelta(hours=report_hours(contact)) - timedelta(minutes=5)
+    hours_since_report = datetime.now() - last_report if last_report else timedelta.max
+    enough_time = hours_since_report >= required_time
+
+    existing_count = len(existing_items)
+
+    # Long operation (no DB connection open)
+    new_items = []
+    passed_links = []
+    feed_states = []
+    if existing_count < sources:
+        try:
+            new_items = await main.refresh_data_async(
+                text, searches, last_cron, registry, taskid=id, passed_links=passed_links, feed_states=feed_states,
+            ) or []
+        except Exception as e:
+            print(f"refresh_data() failed for task {id}: {e}")
+            new_items = []
+            passed_links = []
+            feed_states = []
+
+    total_items = existing_count + len(new_items)
+
+    # Report/email logic
+    reported = False
+    if total_items >= sources and enough_time:
+        all_items = existing_items + new_items
+        try:
+            report = await main.create_report_async(text, all_items, last_report)
+        except Exception as e:
+            # Keep the new items for the next try
+            print(f"create_report() failed for task {id}: {e}")
+            writes.add_items(task, new_items, passed_links, feed_states)
+            return {"status": "error", "error": f"Report failed: {e}", "new_items": len(new_items), "reported": False}
+
+        # The new items went straight into the report, so they're never stored
+        # The email is sent by the outbox sender once the tick's writes are committed
+        writes.add_report(task, email, report, passed_links, feed_states)
+        reported = True
+    else:
+        writes.add_items(task, new_items, passed_links, feed_states)
+
+    writes.add_schedule(task, has_enough_items=total_items >= sources, reported=reported)
+
+    return {"new_items": len(new_items), "reported": reported}
+
+
+async def run_task(task, limit: asyncio.Semaphore, existing_items: list, email: str, writes: TickWrites, registry=None):
+    """
+    task: The task to run.
+    limit: Caps how many tasks run at once.
+    Wraps `process_task` so that one failing task never affects the others.
+    """
+    async with limit:
+        start = time.perf_counter()
+        summary = {"id": task.id, "status": "ok"}
+
+        try:
+            summary.update(await process_task(task, existing_items, email, writes, registry))
+
+        except OperationalError as e:
+            print(f"DB error on task {task.id}: {e}")
+            engine.dispose()
+            summary.update(status="error", error=f"DB error: {e}")
+
+        except Exception as e:
+            print(f"Error processing task {task.id}: {e}")
+            summary.update(status="error", error=str(e))
+
+        # Failed tasks are retried after the normal interval, not on every tick
+        # Whatever made the task fail must not escape here and take the rest of the batch down with it
+        if summary["status"] != "ok":
+            try:
+                writes.add_schedule(task)
+            except Exception as e:
+                print(f"Error scheduling task {task.id}: {e}")
+
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        return summary
+
+
+def report_feeds(registry: FeedRegistry):
+    print(f"=== FEEDS: {registry.requested} REQUESTED, {registry.fetched} FETCHED, {registry.saved} SAVED ===")
+    metrics.incr("feeds.fetched", registry.fetched)
+    metrics.incr("feeds.saved", registry.saved)
+
+
+async def run_tasks_async(tasks, concurrency: int = CRON_CONCURRENCY, registry: FeedRegistry = None):
+    """
+    tasks: All of the tasks to run this tick.
+    concurrency: Max number of tasks being processed at once.
+    registry: Feed registry to share with other calls (a worker shares one between its batches). A new one if not given.
+    Returns the per-task summaries, in the same order as `tasks`.
+    """
+    if not tasks:
+        return []
+
+    # Everything the tasks need from the DB, loaded up front
+    existing = await asyncio.to_thread(load_items, [task.id for task in tasks])
+    emails = await asyncio.to_thread(load_emails, {task.userid for task in tasks})
+
+    # Tasks with the same searches share one fetch per feed
+    own_registry = registry is None
+    if own_registry:
+        registry = FeedRegistry()
+    limit = asyncio.Semaphore(max(1, concurrency))
+    writes = TickWrites()
+
+    try:
+        summaries = await asyncio.gather(*(
+            run_task(task, limit, existing[task.id], emails.get(task.userid), writes, registry)
+            for task in tasks
+        ))
+    finally:
+        # Also keep what finished if the tick is cancelled
+        await asyncio.to_thread(writes.apply)
+
+    if own_registry:
+        report_feeds(registry)
+    return list(summaries)
+
+
+def run_tasks(tasks, concurrency: int = CRON_CONCURRENCY):
+    return aio.run(run_tasks_async(tasks, concurrency))
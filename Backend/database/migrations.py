@@ -0,0 +1,65 @@
+from sqlalchemy import inspect, text
+import time
+
+from .db import Base
+
+# `create_all` only creates missing tables, it never changes existing ones.
+# Columns added to a table after it was first created are listed here, and added
+# on startup if the table doesn't have them yet. They must be nullable (or have a
+# server default), since existing rows won't have a value.
+# Indexes don't need to be listed: every index declared in `models` is created if it's missing.
+ADDED_COLUMNS = [
+    ("items", "alternates"),
+    ("tasks", "next_refresh_at"),
+    ("tasks", "next_report_at"),
+    ("tasks", "status"),
+    ("feedstate", "taskid"),
+]
+
+
+def add_missing_columns(engine):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table_name, column_name in ADDED_COLUMNS:
+            if table_name not in existing_tables:
+                continue
+
+            existing = {c["name"] for c in inspector.get_columns(table_name)}
+            if column_name in existing:
+                continue
+
+            column = Base.metadata.tables[table_name].columns[column_name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            print(f"Adding column {table_name}.{column_name}")
+            conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+
+
+def add_missing_indexes(engine):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            # Can take a while on a big table, but it only ever happens once
+            print(f"Creating index {index.name}")
+            start = time.perf_counter()
+            index.create(bind=engine, checkfirst=True)
+            print(f"Created index {index.name} in {time.perf_counter() - start:.1f}s")
+
+
+def run(engine):
+    """
+    Brings the database up to date with `models`. Safe to run on every startup.
+    """
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
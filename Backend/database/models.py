@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime
+from sqlalchemy import Column, Integer, String, JSON, DateTime, LargeBinary, Index
 from .db import Base
 
 # Tasks that can be created by the user
@@ -6,7 +6,7 @@ class Task(Base):
     __tablename__ = "tasks"
 
     id = Column(Integer, primary_key=True, nullable=False, index=True, autoincrement=True)
-    userid = Column(Integer, nullable=False)
+    userid = Column(Integer, nullable=False, index=True)
     title = Column(String, nullable=False)
     text = Column(String, nullable=False)
     sources = Column(Integer, nullable=False)
@@ -15,19 +15,23 @@ class Task(Base):
     last_report = Column(DateTime, nullable=False)
     contact = Column(Integer, nullable=False)
     reports_sent = Column(Integer, nullable=False)
+    next_refresh_at = Column(DateTime, index=True)  # when cron should next pick this task up (None = as soon as possible)
+    next_report_at = Column(DateTime)  # when the next report is due
+    status = Column(String)  # "generating" while its searches are being made, "failed" if that didn't work (None = ready)
 
 # Items that went through both filters and are waiting to be used
 class Items(Base):
     __tablename__ = "items"
 
     id = Column(Integer, primary_key=True, nullable=False, index=True, autoincrement=True)
-    taskid = Column(Integer, nullable=False)
+    taskid = Column(Integer, nullable=False, index=True)
     userid = Column(Integer, nullable=False)
     task_title = Column(String, nullable=False)
     item_title = Column(String, nullable=False)
     text = Column(String, nullable=False)
     link = Column(String, nullable=False)
     site_date = Column(DateTime)
+    alternates = Column(JSON)  # other outlets' copies of the same story: [{"title", "link"}]
 
 # User information
 class Users(Base):
@@ -45,4 +49,95 @@ class UserActivity(Base):
     id = Column(Integer, primary_key=True, nullable=False, index=True, autoincrement=True)
     userid = Column(Integer, nullable=False)
     action = Column(String, nullable=False)
-    time = Column(DateTime, nullable=False)
\ No newline at end of file
+    time = Column(DateTime, nullable=False)
+
+    # A user's activity is always read newest first
+    __table_args__ = (
+        Index("ix_useractivity_userid_time", "userid", time.desc()),
+    )
+
+# Google News redirect links that were already resolved to the real article URL
+class ResolvedUrls(Base):
+    __tablename__ = "resolvedurls"
+    url_hash = Column(String, primary_key=True, nullable=False)  # sha256 of `url`, since links can be very long
+    url = Column(String, nullable=False)
+    final_url = Column(String, nullable=False)
+    created = Column(DateTime, nullable=False)
+    last_used = Column(DateTime, nullable=False, index=True)
+
+# Extracted article text, shared by every task so the same article is only downloaded once
+class Articles(Base):
+    __tablename__ = "articles"
+    url_hash = Column(String, primary_key=True, nullable=False)  # sha256 of the canonical URL
+    url = Column(String, nullable=False)
+    text = Column(String, nullable=False)
+    content_hash = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    extracted = Column(DateTime, nullable=False)
+    last_used = Column(DateTime, nullable=False, index=True)
+
+# Validators from each task's last poll of each of its searches, for conditional GETs
+class FeedState(Base):
+    __tablename__ = "feedstate"
+    url_hash = Column(String, primary_key=True, nullable=False)  # sha256 of the task id and search
+    taskid = Column(Integer)  # the task that polled the feed
+    url = Column(String, nullable=False)  # the URL these validators came from
+    etag = Column(String)
+    modified = Column(String)
+    checked = Column(DateTime, nullable=False, index=True)
+
+# Cached LLM responses, keyed by a hash of the model, messages and tools
+class LlmCache(Base):
+    __tablename__ = "llmcache"
+    key = Column(String, primary_key=True, nullable=False)
+    model = Column(String, nullable=False)
+    response = Column(JSON, nullable=False)  # [message, tool_name, tool_contents]
+    tokens = Column(Integer, nullable=False)  # tokens the original call used
+    latency_ms = Column(Integer, nullable=False)  # how long the original call took
+    size = Column(Integer, nullable=False)
+    created = Column(DateTime, nullable=False)
+    last_used = Column(DateTime, nullable=False, index=True)
+
+
+# Embedding of each task's text and searches, for the embedding first filter
+class TaskEmbeddings(Base):
+    __tablename__ = "taskembeddings"
+    taskid = Column(Integer, primary_key=True, nullable=False)
+    source_hash = Column(String, nullable=False)  # sha256 of what was embedded, to know when it's outdated
+    dim = Column(Integer, nullable=False)
+    vectors = Column(LargeBinary, nullable=False)  # float32 rows: the task text, then each search
+    created = Column(DateTime, nullable=False)
+
+# RSS links each task already evaluated, so overlapping or retried runs skip them
+class SeenItems(Base):
+    __tablename__ = "seenitems"
+    taskid = Column(Integer, primary_key=True, nullable=False)
+    link_hash = Column(String, primary_key=True, nullable=False)  # sha256 of the RSS link
+    seen = Column(DateTime, nullable=False, index=True)
+
+# Cron work queue: one row per task, claimed by a worker with a lease (see Backend/jobs.py)
+class CronJobs(Base):
+    __tablename__ = "cronjobs"
+    taskid = Column(Integer, primary_key=True, nullable=False)
+    status = Column(String, nullable=False, index=True)  # queued, running, done, failed
+    enqueued = Column(DateTime, nullable=False)
+    lease_owner = Column(String)
+    lease_expires = Column(DateTime, index=True)  # a running job past this is assumed to be from a crashed worker
+    attempts = Column(Integer, nullable=False)  # claims since it was last queued
+    finished = Column(DateTime)
+    result = Column(JSON)  # summary from the last run
+
+# Emails waiting to be sent (or retried) by the background sender (see Backend/outbox.py)
+class Outbox(Base):
+    __tablename__ = "outbox"
+    id = Column(Integer, primary_key=True, nullable=False, index=True, autoincrement=True)
+    kind = Column(String, nullable=False)  # report, onboarding
+    to = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # queued, sending, sent, failed
+    attempts = Column(Integer, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)  # also the lease of a message being sent
+    created = Column(DateTime, nullable=False)
+    sent = Column(DateTime, index=True)
+    last_error = Column(String)
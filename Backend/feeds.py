@@ -0,0 +1,266 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import urllib.parse
+import feedparser
+import hashlib
+import asyncio
+import httpx
+import time
+import os
+
+from Backend.database.db import SessionLocal
+from Backend.database import models
+from Backend import metrics, aio
+
+# Feed fetches running at once overall, and at most this many against a single host (Google News rate limits)
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "16"))
+FEED_HOST_CONCURRENCY = int(os.getenv("FEED_HOST_CONCURRENCY", "4"))
+FEED_CONNECT_TIMEOUT = float(os.getenv("FEED_CONNECT_TIMEOUT", "5"))
+FEED_READ_TIMEOUT = float(os.getenv("FEED_READ_TIMEOUT", "15"))
+
+# Every poll of a search asks for the same window, and entries older than the task's own cutoff are dropped locally.
+# Polls are an hour or so apart, so this only has to cover the gap between two of them with room to spare
+FEED_WINDOW_HOURS = int(os.getenv("FEED_WINDOW_HOURS", "48"))
+
+# Validators of feeds that haven't been polled in this long are dropped
+FEED_STATE_RETENTION_DAYS = int(os.getenv("FEED_STATE_RETENTION_DAYS", "14"))
+
+# One keep-alive connection pool for all feed requests
+client = httpx.AsyncClient(
+    timeout=httpx.Timeout(FEED_READ_TIMEOUT, connect=FEED_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=FEED_WORKERS, max_keepalive_connections=FEED_WORKERS),
+    headers={"User-Agent": "Mozilla/5.0 (compatible; ProactiveAI/1.0)"},
+)
+
+_host_limits = defaultdict(lambda: asyncio.Semaphore(FEED_HOST_CONCURRENCY))
+
+
+def feed_url(query: str) -> str:
+    # Encode the query into a URL
+    encoded_query = urllib.parse.quote(query)
+    return f"https://news.google.com/rss/search?q={encoded_query}+when:{FEED_WINDOW_HOURS}h"
+
+
+def _state_key(taskid: int, query: str) -> str:
+    return hashlib.sha256(f"{taskid}:{query}".encode("utf-8")).hexdigest()
+
+
+# Validators belong to the task that polled the feed, since a 304 only means "nothing new" to a task that already filtered that response
+
+def get_validators(taskid: int, query: str, url: str):
+    try:
+        with SessionLocal() as db:
+            state = db.get(models.FeedState, _state_key(taskid, query))
+            if state and state.url == url:
+                return state.etag, state.modified
+    except Exception as e:
+        print(f"Feed state lookup failed: {e}")
+    return None, None
+
+
+def state_row(taskid: int, query: str, url: str, etag: str, modified: str) -> dict:
+    """
+    A `FeedState` row for the caller to write once whatever the task made of the feed is stored.
+    """
+    return {
+        "url_hash": _state_key(taskid, query),
+        "taskid": taskid,
+        "url": url,
+        "etag": etag,
+        "modified": modified,
+        "checked": datetime.now(),
+    }
+
+
+async def fetch_feed(url: str, etag: str = None, modified: str = None):
+    """
+    url: The RSS feed URL.
+    etag, modified: Validators from the caller's last poll of this URL, if any.
+    Downloads the feed over the shared client and parses it.
+    Returns `(feed, etag, modified)`, where `feed` is None if it hasn't changed since the given validators.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+
+    host = urllib.parse.urlparse(url).netloc.lower()
+    async with _host_limits[host]:
+        response = await client.get(url, headers=headers)
+
+    if response.status_code == 304:
+        metrics.incr("feeds.not_modified")
+        return None, etag, modified
+
+    response.raise_for_status()
+
+    return feedparser.parse(response.content), response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+
+def prune_feed_states():
+    cutoff = datetime.now() - timedelta(days=FEED_STATE_RETENTION_DAYS)
+    with SessionLocal() as db:
+        db.query(models.FeedState).filter(models.FeedState.checked < cutoff).delete(synchronize_session=False)
+        db.commit()
+
+
+def parse_entries(feed, limit: int = 15, since: datetime = None):
+    output = ""
+    output_dict = {}
+
+    for entry in feed.entries:
+        published = getattr(entry, "published", None)
+        published_parsed = getattr(entry, "published_parsed", None)
+
+        # Skip if no timestamp
+        if not published_parsed:
+            continue
+
+        entry_date = datetime.fromtimestamp(time.mktime(published_parsed))
+
+        # Older than the window this poll is for
+        if since and entry_date < since:
+            continue
+
+        title = entry.title
+        link = entry.link
+
+        output += f"{title} - {published if published else 'No timestamp'}\n\n"
+        output_dict[title] = {
+            "link": link,
+            "published": published
+        }
+
+        if len(output_dict) >= limit:
+            break
+
+    return output_dict, output.strip()
+
+
+async def poll_feed(query: str, url: str, etag: str = None, modified: str = None):
+    """
+    Fetches one search's feed, conditionally if validators are given.
+    Returns `(feed, etag, modified)`. `feed` is None if the fetch failed or nothing changed since the validators.
+    """
+    try:
+        feed, etag, modified = await fetch_feed(url, etag, modified)
+    except Exception as e:
+        print(f"Feed fetch failed for '{query}': {e}")
+        return None, None, None
+
+    # Nothing changed since the poll these validators came from, so there's nothing new to filter
+    if feed is None:
+        print(f"=== FEED UNCHANGED: '{query}' ===")
+
+    return feed, etag, modified
+
+
+async def load_validators(taskid: int, query: str, url: str):
+    if taskid is None:
+        return None, None
+    return await asyncio.to_thread(get_validators, taskid, query, url)
+
+
+def read_poll(query: str, url: str, poll, limit: int, hours: int, taskid: int = None, feed_states: list = None):
+    """
+    Turns a `poll_feed` result into `(output_dict, output_str)` for a task that wants the last `hours` of it.
+    Adds the validators the task should send next time to `feed_states`.
+    """
+    feed, etag, modified = poll
+    if feed is None:
+        return {}, ""
+
+    if taskid is not None and feed_states is not None:
+        feed_states.append(state_row(taskid, query, url, etag, modified))
+
+    return parse_entries(feed, limit, since=datetime.now() - timedelta(hours=hours))
+
+
+async def get_news_feed_async(query: str, limit: int = 15, hours: int = 6, taskid: int = None, feed_states: list = None):
+    """
+    taskid: The task polling the feed. Only a task's own earlier polls make a conditional request.
+    feed_states: Gets the `FeedState` row to store for the next conditional request, if any.
+    """
+    # Under an hour since the last report, too short a window to poll
+    if hours == 0:
+        return {}, ""
+
+    url = feed_url(query)
+    etag, modified = await load_validators(taskid, query, url)
+    poll = await poll_feed(query, url, etag, modified)
+    return read_poll(query, url, poll, limit, hours, taskid, feed_states)
+
+
+async def get_news_feeds_async(queries: list, limit: int = 15, hours: int = 6, taskid: int = None, feed_states: list = None):
+    """
+    queries: The searches to fetch.
+    Fetches every search at once. Returns the `(output_dict, output_str)` results in the same order as `queries`.
+    """
+    return list(await asyncio.gather(*(get_news_feed_async(q, limit, hours, taskid, feed_states) for q in queries)))
+
+
+def get_news_feed(query: str, limit: int = 15, hours: int = 6):
+    return aio.run(get_news_feed_async(query, limit, hours))
+
+
+def get_news_feeds(queries: list, limit: int = 15, hours: int = 6):
+    return aio.run(get_news_feeds_async(queries, limit, hours))
+
+
+class FeedRegistry:
+    """
+    Shares feed fetches between every task of one cron tick.
+
+    Tasks often end up with the same searches, so each search is only fetched once.
+    The first task to ask does the fetch, and any other task asking for the same search
+    waits for that result instead of fetching it again. Each task then keeps the part
+    of the feed that's newer than its own cutoff.
+
+    A conditional fetch is only shared between tasks that hold the same validators, so a
+    304 never reaches a task that didn't see the response it refers to.
+    """
+
+    def __init__(self, limit: int = 15):
+        self.limit = limit
+        self.requested = 0
+        self._results = {}
+
+    @staticmethod
+    def _key(search: str):
+        # Google News search isn't case or whitespace sensitive
+        return " ".join(search.lower().split())
+
+    async def get(self, search: str, hours: int, taskid: int = None, feed_states: list = None):
+        # Under an hour since the last report, too short a window to poll
+        if hours == 0:
+            return {}, ""
+
+        self.requested += 1
+
+        url = feed_url(search)
+        validators = await load_validators(taskid, search, url)
+        key = (self._key(search),) + validators
+
+        # Everything runs on the one pipeline loop, so there's no race between the check and the insert
+        task = self._results.get(key)
+        if task is None:
+            task = self._results[key] = asyncio.ensure_future(poll_feed(search, url, *validators))
+
+        # Shielded so one task being cancelled doesn't cancel the fetch for everyone else
+        poll = await asyncio.shield(task)
+        return read_poll(search, url, poll, self.limit, hours, taskid, feed_states)
+
+    async def get_many(self, searches: list, hours: int, taskid: int = None, feed_states: list = None):
+        """
+        Same as `get_news_feeds_async`, but shared with the rest of the tick.
+        """
+        return list(await asyncio.gather(*(self.get(q, hours, taskid, feed_states) for q in searches)))
+
+    @property
+    def fetched(self) -> int:
+        return len(self._results)
+
+    @property
+    def saved(self) -> int:
+        return self.requested - self.fetched
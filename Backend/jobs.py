@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, bindparam, func, insert, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+import os
+
+from Backend.database.db import SessionLocal, engine
+from Backend.database import models
+from Backend import metrics
+
+# How long a claimed job belongs to a worker. Workers renew it while they run, so it only runs out if the worker died
+CRON_LEASE_SECONDS = int(os.getenv("CRON_LEASE_SECONDS", "600"))
+
+# DB-backed queue of cron work.
+#
+# `/run_cron` only enqueues the tasks that are due, and workers (Backend/worker.py)
+# claim them in batches. A claim takes a lease: the job belongs to that worker until
+# the lease runs out, so overlapping ticks or several worker processes never run the
+# same task twice. On Postgres, candidates are locked with FOR UPDATE SKIP LOCKED so
+# workers don't block each other. Everywhere (including SQLite), the claim itself is a
+# conditional UPDATE that only takes jobs that are still free.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+table = models.CronJobs
+
+
+def _claimable(now: datetime):
+    return or_(
+        table.status == QUEUED,
+        and_(table.status == RUNNING, table.lease_expires < now),
+    )
+
+
+def _insert_ignore():
+    # Another enqueue may insert the same task at the same time
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table.__table__).on_conflict_do_nothing(index_elements=["taskid"])
+    if engine.dialect.name == "sqlite":
+        return sqlite.insert(table.__table__).on_conflict_do_nothing(index_elements=["taskid"])
+    return insert(table.__table__)
+
+
+def enqueue(task_ids: list) -> int:
+    """
+    task_ids: Tasks to run.
+    Queues every task that isn't already queued or being worked on. Returns how many were queued.
+    """
+    if not task_ids:
+        return 0
+
+    now = datetime.now()
+    with SessionLocal() as db:
+        # Finished jobs (or ones whose worker died) go back into the queue
+        requeued = db.execute(
+            update(table)
+            .where(table.taskid.in_(task_ids))
+            .where(or_(table.status.in_([DONE, FAILED]), and_(table.status == RUNNING, table.lease_expires < now)))
+            .values(status=QUEUED, enqueued=now, lease_owner=None, lease_expires=None, attempts=0)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+        known = {id for (id,) in db.query(table.taskid).filter(table.taskid.in_(task_ids))}
+        new = [
+            {"taskid": id, "status": QUEUED, "enqueued": now, "attempts": 0}
+            for id in task_ids if id not in known
+        ]
+        if new:
+            db.execute(_insert_ignore(), new)
+        db.commit()
+
+    queued = requeued + len(new)
+    metrics.incr("cron.enqueued", queued)
+    return queued
+
+
+def claim(owner: str, limit: int) -> list:
+    """
+    owner: Unique name of the worker.
+    limit: Most jobs to take.
+    Leases up to `limit` free jobs to `owner`, oldest first. Returns their task ids.
+    """
+    now = datetime.now()
+    with SessionLocal() as db:
+        candidates = [
+            id for (id,) in db.query(table.taskid)
+            .filter(_claimable(now))
+            .order_by(table.enqueued)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ]
+        if not candidates:
+            return []
+
+        # Only takes the jobs nobody claimed since the select (this is what makes SQLite safe)
+        claimed = [
+            id for (id,) in db.execute(
+                update(table)
+                .where(table.taskid.in_(candidates))
+                .where(_claimable(now))
+                .values(
+                    status=RUNNING,
+                    lease_owner=owner,
+                    lease_expires=now + timedelta(seconds=CRON_LEASE_SECONDS),
+                    attempts=table.attempts + 1,
+                )
+                .returning(table.taskid)
+                .execution_options(synchronize_session=False)
+            )
+        ]
+        db.commit()
+
+    metrics.incr("cron.claimed", len(claimed))
+    return claimed
+
+
+def renew(owner: str, task_ids: list) -> int:
+    """
+    Extends the leases `owner` still holds. Returns how many it still had.
+    """
+    if not task_ids:
+        return 0
+
+    with SessionLocal() as db:
+        renewed = db.execute(
+            update(table)
+            .where(table.taskid.in_(task_ids), table.lease_owner == owner, table.status == RUNNING)
+            .values(lease_expires=datetime.now() + timedelta(seconds=CRON_LEASE_SECONDS))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+    return renewed
+
+
+def complete(owner: str, results: dict):
+    """
+    owner: The worker that ran the jobs.
+    results: Summary of each task's run, by task id (None if the task no longer exists).
+    Marks the jobs done or failed, unless `owner` lost their lease in the meantime.
+    """
+    if not results:
+        return
+
+    now = datetime.now()
+    rows = [
+        {
+            "b_taskid": id,
+            "b_status": FAILED if summary and summary.get("status") != "ok" else DONE,
+            "b_result": summary,
+        }
+        for id, summary in results.items()
+    ]
+
+    with SessionLocal() as db:
+        db.execute(
+            update(table.__table__)
+            .where(table.taskid == bindparam("b_taskid"), table.lease_owner == owner)
+            .values(status=bindparam("b_status"), result=bindparam("b_result"), finished=now, lease_owner=None, lease_expires=None),
+            rows,
+        )
+        db.commit()
+
+
+def load_tasks(task_ids: list) -> list:
+    with SessionLocal() as db:
+        return db.query(models.Task).filter(models.Task.id.in_(task_ids)).order_by(models.Task.id).all()
+
+
+def counts() -> dict:
+    with SessionLocal() as db:
+        return dict(db.query(table.status, func.count()).group_by(table.status).all())
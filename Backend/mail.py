@@ -1,43 +1,201 @@
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from email.mime.text import MIMEText
 from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone
+import threading
+import httplib2
+import time
+import smtplib
 import base64
+import uuid
 import os
 import json
 
+from Backend import metrics
+
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
 load_dotenv()
 
 token_json = os.getenv("GOOGLE_TOKEN_JSON")
 
-def get_gmail_service():
-    creds = None
+# Refresh the Gmail access token this long before it expires, so a send never waits on a refresh
+GMAIL_REFRESH_MARGIN_SECONDS = int(os.getenv("GMAIL_REFRESH_MARGIN_SECONDS", "300"))
+
+# Which transport sends mail: "gmail", "smtp" (e.g. a local MailHog/smtp4dev), or "file" (writes .eml files, for tests)
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "gmail")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "0") == "1"
+SMTP_FROM = os.getenv("SMTP_FROM", "Proactive AI <noreply@localhost>")
+
+MAIL_DIR = os.getenv("MAIL_DIR", "mail_out")
 
-    if token_json:
-        creds = Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
 
-    # Refresh expired creds if possible
-    if creds and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-        os.environ["GOOGLE_TOKEN_JSON"] = creds.to_json()  # update in memory (Render has no writable disk)
+def get_credentials():
+    creds = None
+
+    # Read at call time, since a refresh stores the new token here
+    token = os.getenv("GOOGLE_TOKEN_JSON") or token_json
+    if token:
+        creds = Credentials.from_authorized_user_info(json.loads(token), SCOPES)
 
-    if not creds or not creds.valid:
+    if not creds:
         raise Exception("No valid Gmail credentials. GOOGLE_TOKEN_JSON missing or invalid.")
 
-    return build("gmail", "v1", credentials=creds)
+    return creds
 
 
-def send_message(to, subject, message_text, sender="me"):
-    service = get_gmail_service()
+class GmailService:
+    """
+    One Gmail API client for the whole process, shared by every thread that sends mail.
+
+    The discovery client is built once. The credentials are refreshed shortly before
+    they expire (GMAIL_REFRESH_MARGIN_SECONDS) instead of when a send fails. httplib2
+    connections aren't thread-safe, so each thread executes requests over its own
+    authorized connection, all sharing the same credentials.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._creds = None
+        self._service = None
+
+    def _needs_refresh(self) -> bool:
+        if not self._creds.valid:
+            return True
+        if self._creds.expiry is None:
+            return False
+        # google-auth keeps `expiry` as naive UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return self._creds.expiry - now <= timedelta(seconds=GMAIL_REFRESH_MARGIN_SECONDS)
+
+    def _refresh(self):
+        start = time.perf_counter()
+        self._creds.refresh(Request())
+        metrics.observe("gmail.refresh_ms", (time.perf_counter() - start) * 1000)
+        os.environ["GOOGLE_TOKEN_JSON"] = self._creds.to_json()  # update in memory (Render has no writable disk)
+
+    def get(self):
+        """
+        Returns the shared service, with credentials that are good for at least GMAIL_REFRESH_MARGIN_SECONDS.
+        """
+        with self._lock:
+            if self._creds is None:
+                self._creds = get_credentials()
+
+            if self._needs_refresh() and self._creds.refresh_token:
+                self._refresh()
+
+            if not self._creds.valid:
+                raise Exception("No valid Gmail credentials. GOOGLE_TOKEN_JSON missing or invalid.")
+
+            if self._service is None:
+                start = time.perf_counter()
+                self._service = build("gmail", "v1", credentials=self._creds, cache_discovery=False)
+                metrics.observe("gmail.build_ms", (time.perf_counter() - start) * 1000)
+
+            return self._service
+
+    def http(self):
+        # This thread's connection
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = AuthorizedHttp(self._creds, http=httplib2.Http(timeout=30))
+        return http
+
+    def execute(self, request_fn):
+        """
+        request_fn: Takes the service and returns the request to run.
+        """
+        request = request_fn(self.get())
+
+        start = time.perf_counter()
+        try:
+            return request.execute(http=self.http())
+        finally:
+            metrics.observe("gmail.send_ms", (time.perf_counter() - start) * 1000)
+
+
+gmail = GmailService()
+
+
+def get_gmail_service():
+    return gmail.get()
+
+
+def build_message(to, subject, message_text, sender):
     message = MIMEText(message_text, "html")
     message["to"] = to
     message["from"] = sender
     message["subject"] = subject
+    return message
+
+
+class GmailTransport:
+    """
+    Sends through the Gmail API, using the process-wide `gmail` service.
+    """
+
+    def send(self, to, subject, message_text, sender="me"):
+        raw = base64.urlsafe_b64encode(build_message(to, subject, message_text, sender).as_bytes()).decode()
+        body = {"raw": raw}
+
+        return gmail.execute(lambda service: service.users().messages().send(userId="me", body=body))
+
+
+class SmtpTransport:
+    def send(self, to, subject, message_text, sender="me"):
+        message = build_message(to, subject, message_text, SMTP_FROM if sender == "me" else sender)
 
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    body = {"raw": raw}
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASSWORD)
+            smtp.send_message(message)
 
-    return service.users().messages().send(userId="me", body=body).execute()
\ No newline at end of file
+
+class FileTransport:
+    """
+    Writes every message to MAIL_DIR as an .eml file instead of sending it.
+    """
+
+    def send(self, to, subject, message_text, sender="me"):
+        os.makedirs(MAIL_DIR, exist_ok=True)
+        message = build_message(to, subject, message_text, sender)
+
+        path = os.path.join(MAIL_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.eml")
+        with open(path, "wb") as f:
+            f.write(message.as_bytes())
+        return {"id": path}
+
+
+transports = {
+    "gmail": GmailTransport,
+    "smtp": SmtpTransport,
+    "file": FileTransport,
+}
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        if MAIL_TRANSPORT not in transports:
+            raise Exception(f"Unknown MAIL_TRANSPORT '{MAIL_TRANSPORT}', use one of {', '.join(transports)}")
+        _transport = transports[MAIL_TRANSPORT]()
+    return _transport
+
+
+# Sends right away. Reports and onboarding mail go through the outbox instead (see Backend/outbox.py)
+def send_message(to, subject, message_text, sender="me"):
+    return get_transport().send(to, subject, message_text, sender)
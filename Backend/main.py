@@ -1,17 +1,20 @@
-import feedparser
-import urllib.parse
-import time
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 from cerebras.cloud.sdk import Cerebras
 from newspaper import Article
 import json
-import difflib
-import requests
 import markdown
 import random
-from playwright.sync_api import sync_playwright, Error as PlaywrightError
+import asyncio
+import time
+import httpx
+import numpy as np
+from collections import deque
+
+from Backend.browser import resolve_url, resolve_url_async
+from Backend.feeds import get_news_feed, get_news_feeds, get_news_feeds_async, FeedRegistry
+from Backend import cache, transport, aio, vectors
 
 
 ####################
@@ -19,46 +22,6 @@ from playwright.sync_api import sync_playwright, Error as PlaywrightError
 ####################
 
 
-def get_news_feed(query: str, limit: int = 15, hours: int = 6):
-    # `when:0h` will give results from all times, so if it's 0 hours then return
-    if hours == 0:
-        return {}, ""
-    
-    # Encode the query into a URL
-    encoded_query = urllib.parse.quote(query)
-    feed_url = f"https://news.google.com/rss/search?q={encoded_query}+when:{hours}h"
-
-    feed = feedparser.parse(feed_url)
-    length = len(feed.entries)
-
-    output = ""
-    output_dict = {}
-
-    for i in range(length):
-        entry = feed.entries[i]
-        published = getattr(entry, "published", None)
-        published_parsed = getattr(entry, "published_parsed", None)
-
-        # Skip if no timestamp
-        if not published_parsed:
-            continue
-
-        entry_date = datetime.fromtimestamp(time.mktime(published_parsed))
-
-        title = entry.title
-        link = entry.link
-
-        output += f"{title} - {published if published else 'No timestamp'}\n\n"
-        output_dict[title] = {
-            "link": link,
-            "published": published
-        }
-
-        if len(output_dict) >= limit:
-            break
-
-    return output_dict, output.strip()
-
 start_messages = [
     {"role": "system", "content": """
     You are a helpful AI. You will be connected to an RSS feed based on the user's request. 
@@ -152,8 +115,30 @@ load_dotenv()
 api_key = os.getenv("API_KEY")
 or_key = os.getenv("OR_KEY")
 
+# "batched" sends every title of a task in one numbered prompt, "per_search" does one call per search,
+# "embedding" skips the LLM and keeps titles that are similar enough to the task (see Backend/vectors.py)
+FIRST_FILTER_MODE = os.getenv("FIRST_FILTER_MODE", "batched")
+FIRST_FILTER_CHUNK = int(os.getenv("FIRST_FILTER_CHUNK", "100"))
+
+# Embedding filter: minimum cosine similarity to pass, and how many of the best titles always pass anyway
+# Lower the threshold or raise the minimum to trade LLM work in the second filter for fewer false negatives
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", "0.12"))
+PREFILTER_MIN_KEEP = int(os.getenv("PREFILTER_MIN_KEEP", "15"))
+
+# Second filter: items evaluated at once per task
+SECOND_FILTER_CONCURRENCY = int(os.getenv("SECOND_FILTER_CONCURRENCY", "6"))
+
+# Client for downloading article pages (newspaper only parses them)
+article_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(float(os.getenv("ARTICLE_TIMEOUT", "15"))),
+    follow_redirects=True,
+    headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"},
+)
+
 client = Cerebras(
   api_key=api_key,
+  http_client=transport.httpx_client,
+  max_retries=transport.LLM_MAX_RETRIES,
 )
 
 def cerebras_completion(messages, tools):
@@ -185,26 +170,27 @@ def cerebras_completion(messages, tools):
 
   return message_resp, tool_name, tool_contents
 
-def openrouter_completion(messages, tools):
-    response = requests.post(
+OPENROUTER_MODEL = "meta-llama/llama-4-scout"
+
+def openrouter_request(messages, tools):
+    return dict(
         url="https://openrouter.ai/api/v1/chat/completions",
         headers={
             "Authorization": f"Bearer {or_key}",
             "Content-Type": "application/json",
         },
-        data=json.dumps({
-            "model": "meta-llama/llama-4-scout",
+        payload={
+            "model": OPENROUTER_MODEL,
             "messages": messages,
             "tools": tools,
             "provider": {
                 "order": ["cerebras"],
                 "allow_fallbacks": False
             }
-        })
+        }
     )
 
-    # Parse top-level JSON
-    resp = response.json()
+def parse_openrouter_response(resp):
     message = resp["choices"][0]["message"]
     message_resp = message.get("content")
     tool_name, tool_contents = None, None
@@ -227,28 +213,179 @@ def openrouter_completion(messages, tools):
 
     return message_resp, tool_name, tool_contents
 
-def chat(messages, tools=None, need_tool=False):
+# `usage`, if given, gets the token counts of the call added to it
+def add_usage(usage, resp):
+    if usage is not None:
+        usage["tokens"] = usage.get("tokens", 0) + (resp.get("usage") or {}).get("total_tokens", 0)
+
+def openrouter_completion(messages, tools, usage=None):
+    # Parse top-level JSON
+    resp = transport.post_json(**openrouter_request(messages, tools))
+    add_usage(usage, resp)
+    return parse_openrouter_response(resp)
+
+async def openrouter_completion_async(messages, tools, usage=None):
+    resp = await transport.post_json_async(**openrouter_request(messages, tools))
+    add_usage(usage, resp)
+    return parse_openrouter_response(resp)
+
+def chat(messages, tools=None, need_tool=False, use_cache=True):
+    # Identical prompts can be answered from the response cache (when LLM_CACHE_ENABLED is on)
+    key = cache.llm_key(OPENROUTER_MODEL, messages, tools) if cache.LLM_CACHE_ENABLED and use_cache else None
+    if key:
+        cached = cache.get_llm_response(key)
+        if cached:
+            return cached
+
+    usage = {}
+    start = time.perf_counter()
+
     for _ in range(3):
         # message, tool_name, tool_contents = cerebras_completion(messages, tools)
 
-        message, tool_name, tool_contents = openrouter_completion(messages, tools)
+        message, tool_name, tool_contents = openrouter_completion(messages, tools, usage)
 
         if need_tool and not tool_name:
             continue # retry if a tool is required
 
+        if key:
+            latency_ms = int((time.perf_counter() - start) * 1000)
+            cache.store_llm_response(key, OPENROUTER_MODEL, (message, tool_name, tool_contents), usage.get("tokens", 0), latency_ms)
+
+        return message, tool_name, tool_contents
+
+    # If it's still nothing
+    return message, tool_name, tool_contents
+
+# Same as `chat`, for the async pipeline
+async def chat_async(messages, tools=None, need_tool=False, use_cache=True):
+    key = cache.llm_key(OPENROUTER_MODEL, messages, tools) if cache.LLM_CACHE_ENABLED and use_cache else None
+    if key:
+        cached = await asyncio.to_thread(cache.get_llm_response, key)
+        if cached:
+            return cached
+
+    usage = {}
+    start = time.perf_counter()
+
+    for _ in range(3):
+        message, tool_name, tool_contents = await openrouter_completion_async(messages, tools, usage)
+
+        if need_tool and not tool_name:
+            continue # retry if a tool is required
+
+        if key:
+            latency_ms = int((time.perf_counter() - start) * 1000)
+            await asyncio.to_thread(cache.store_llm_response, key, OPENROUTER_MODEL, (message, tool_name, tool_contents), usage.get("tokens", 0), latency_ms)
+
         return message, tool_name, tool_contents
 
     # If it's still nothing
     return message, tool_name, tool_contents
 
 # Fuzzy matching since the AI sometimes does not include parts of the title
-def find_best_match(model_title, news_dict):
-    matches = difflib.get_close_matches(model_title, news_dict.keys(), n=1, cutoff=0.5)
-    if matches:
-        return news_dict[matches[0]]
+def find_best_match(model_title, news_dict, index: vectors.TitleIndex = None):
+    # Pass an index built over `news_dict` when matching more than one title
+    match = (index or vectors.TitleIndex(news_dict)).match(model_title)
+    if match:
+        return news_dict[match]
     return ""
 
 
+# Tool for the batched first filter: the model picks items by their number instead of retyping titles
+batch_tools = [
+    {
+        "type": "function",
+        "function": {
+            "name": "mark",
+            "strict": True,
+            "description": "Mark RSS items as relevant to the user's request.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "indices": {
+                        "type": "array",
+                        "items": {
+                            "type": "integer"
+                        },
+                        "description": "The numbers of the relevant items."
+                    }
+                },
+                "required": ["indices"]
+            }
+        }
+    }
+]
+
+async def first_filter_batched(user_query: str, titles: list):
+    """
+    user_query: The query from the user.
+    titles: Every deduplicated RSS title from all of the searches.
+    Returns the titles that the model kept, in their original order.
+    """
+    async def filter_chunk(chunk):
+        numbered = "\n".join(f"{i}. {title}" for i, title in enumerate(chunk, 1))
+
+        messages = [
+            {"role": "assistant", "content": f"""
+            {numbered}
+
+            This is a numbered list of the most recent RSS items for the user query: '{user_query}'.
+            I will now use tool 'mark' with the numbers of every item whose title could possibly apply to the user's query.
+            I will avoid False Negatives, preferring False Positives. I will ONLY leave out items that are OBVIOUSLY and ENTIRELY irrelevant.
+            I will only use numbers from the list above (1 to {len(chunk)}).
+            """}
+        ]
+        _, _, tool_contents = await chat_async(messages, batch_tools, True)
+
+        # Handle tool calling issues
+        if isinstance(tool_contents, str):
+            try:
+                tool_contents = json.loads(tool_contents)
+            except json.JSONDecodeError:
+                tool_contents = {}
+
+        indices = tool_contents.get("indices", []) if isinstance(tool_contents, dict) else []
+
+        picked = set()
+        for i in indices:
+            try:
+                i = int(i)
+            except (TypeError, ValueError):
+                continue
+            if 1 <= i <= len(chunk):
+                picked.add(i)
+
+        return [chunk[i - 1] for i in sorted(picked)]
+
+    # Split into chunks so very large ticks don't blow up the prompt, and send the chunks at once
+    chunks = [titles[start:start + FIRST_FILTER_CHUNK] for start in range(0, len(titles), FIRST_FILTER_CHUNK)]
+    results = await asyncio.gather(*(filter_chunk(chunk) for chunk in chunks))
+
+    return [title for picked in results for title in picked]
+
+
+def first_filter_embedding(taskid: int, user_query: str, searches: list, titles: list):
+    """
+    taskid: The task, so its embedding is only computed once (None to not store it).
+    user_query: The query from the user.
+    searches: All of the 7 searches.
+    titles: Every deduplicated RSS title from all of the searches.
+    Returns the titles that are similar enough to the query or any search, in their original order.
+    """
+    queries = cache.get_task_vectors(taskid, user_query, searches)
+    scores = vectors.similarity(queries, vectors.embed(titles))
+
+    keep = scores >= PREFILTER_THRESHOLD
+
+    # Always let the best few through, to avoid false negatives on quiet topics
+    if PREFILTER_MIN_KEEP > 0:
+        keep[np.argsort(-scores, kind="stable")[:PREFILTER_MIN_KEEP]] = True
+
+    print(f"=== EMBEDDING FILTER KEPT {int(keep.sum())} OF {len(titles)} ===")
+    return [title for title, k in zip(titles, keep) if k]
+
+
 def create_query(user_query: str):
     """
     user_query: The query from the user.
@@ -258,7 +395,8 @@ def create_query(user_query: str):
     attempts = 0
 
     while attempts < 3 and len(best_searches) < 7:
-        _, _, tool_contents = chat(messages, start_tools, True)
+        # Retries are meant to get a different answer, so only the first attempt can come from the cache
+        _, _, tool_contents = chat(messages, start_tools, True, use_cache=attempts == 0)
 
         # Ensure tool_contents is a dictionary
         if isinstance(tool_contents, str):
@@ -284,11 +422,44 @@ def create_query(user_query: str):
 ####################
 
 
+async def download_article(url: str) -> str:
+    try:
+        response = await article_client.get(url)
+        response.raise_for_status()
+
+        # Parsing is CPU-bound, keep it off the event loop
+        def parse(html):
+            article = Article(url)
+            article.download(input_html=html)
+            article.parse()
+            return article.text
+
+        return await asyncio.to_thread(parse, response.text)
+    except Exception as e:
+        return f"ERROR: failed to get main content ({e})"
+
+
+def hours_since(last_time: datetime) -> int:
+    return int((datetime.now() - last_time).total_seconds() / 3600)
+
+
 def refresh_data(user_query: str, searches: list, last_time: datetime):
+    """
+    Sync wrapper around `refresh_data_async`.
+    """
+    return aio.run(refresh_data_async(user_query, searches, last_time))
+
+
+async def refresh_data_async(user_query: str, searches: list, last_time: datetime, registry: FeedRegistry = None, taskid: int = None, passed_links: list = None, feed_states: list = None):
     """
     user_query: The query from the user.
     searches: All of the 7 searches.
     last_time: Last time that a cron job was run.
+    registry: Optional feed registry shared by all tasks of the cron tick.
+    taskid: The task being refreshed, if any.
+    passed_links: If given, the links of stories that passed are added to it instead of being marked seen,
+    so the caller can mark them in the same transaction that stores the items.
+    feed_states: If given, gets the `FeedState` rows to store with the items, for conditional requests next time.
     """
 
 
@@ -302,7 +473,7 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
     print(user_query)
     print()
 
-    hours = int((datetime.now() - last_time).total_seconds() / 3600)
+    hours = hours_since(last_time)
 
     print(f"=== {hours} HOURS HAVE PASSED ===")
     print()
@@ -316,8 +487,13 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
 
     valid_items = 0
 
-    for search in searches:
-        output_dict, output_str = get_news_feed(search, hours=hours)
+    # Fetch every search's feed at once
+    if registry:
+        feeds = await registry.get_many(searches, hours, taskid, feed_states)
+    else:
+        feeds = await get_news_feeds_async(searches, hours=hours, taskid=taskid, feed_states=feed_states)
+
+    for search, (output_dict, output_str) in zip(searches, feeds):
 
         # If there are no results
         if output_str == '':
@@ -328,37 +504,55 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
 
         valid_items += len(output_dict)
 
-        messages = list(start_messages) + [
-            {"role": "assistant", "content": f"{output_str} This is a list of the most recent RSS items for the search '{search}'. I will now use tool 'mark' if any of the items' titles seem like they could possibly apply to the user's query. I will avoid False Negatives, preferring False Positives. I will NOT use 'hook' because I already did that."},
-        ]
-        _, _, tool_contents = chat(messages, start_tools, True)
-
-        # Handle tool calling issues
-        if isinstance(tool_contents, str):
-            titles = json.loads(tool_contents)["titles"]
-        elif isinstance(tool_contents, dict):
-            titles = tool_contents["titles"]
-
         all_rss_items.extend(output_dict.keys())
-        chosen_titles.extend(titles)
-        all_news_dicts.append(output_dict)
+        all_news_dicts.append((search, output_dict, output_str))
 
     # Deduplicate RSS titles
     all_rss_items = list(dict.fromkeys(all_rss_items))
-    chosen_titles = list(dict.fromkeys(chosen_titles))
 
     if len(all_rss_items) == 0:
         return []
 
     # Merge all dicts
     combined_news_dict = {}
-    for nd in all_news_dicts:
+    for _, nd, _ in all_news_dicts:
         combined_news_dict.update(nd)
 
-    # Map chosen titles to links
-    chosen_dict = {}
-    for t in chosen_titles:
-        chosen_dict[t] = find_best_match(t, combined_news_dict)
+    if FIRST_FILTER_MODE == "batched":
+        # One call over every title, and the model answers with indices so the titles map back exactly
+        chosen_titles = await first_filter_batched(user_query, all_rss_items)
+        chosen_dict = {t: combined_news_dict[t] for t in chosen_titles}
+
+    elif FIRST_FILTER_MODE == "embedding":
+        # No LLM call, just similarity between the titles and the task
+        chosen_titles = await asyncio.to_thread(first_filter_embedding, taskid, user_query, searches, all_rss_items)
+        chosen_dict = {t: combined_news_dict[t] for t in chosen_titles}
+
+    else:
+        # One call per search, all sent at once
+        async def filter_search(search, output_str):
+            messages = list(start_messages) + [
+                {"role": "assistant", "content": f"{output_str} This is a list of the most recent RSS items for the search '{search}'. I will now use tool 'mark' if any of the items' titles seem like they could possibly apply to the user's query. I will avoid False Negatives, preferring False Positives. I will NOT use 'hook' because I already did that."},
+            ]
+            _, _, tool_contents = await chat_async(messages, start_tools, True)
+
+            # Handle tool calling issues
+            if isinstance(tool_contents, str):
+                return json.loads(tool_contents)["titles"]
+            elif isinstance(tool_contents, dict):
+                return tool_contents["titles"]
+            return []
+
+        results = await asyncio.gather(*(filter_search(search, output_str) for search, _, output_str in all_news_dicts))
+        for titles in results:
+            chosen_titles.extend(titles)
+
+        chosen_titles = list(dict.fromkeys(chosen_titles))
+
+        # Map chosen titles to links, matching them all against one index
+        index = vectors.TitleIndex(combined_news_dict)
+        matches = index.match_many(chosen_titles)
+        chosen_dict = {t: combined_news_dict[m] if m else "" for t, m in zip(chosen_titles, matches)}
 
 
     #####################
@@ -366,45 +560,27 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
     #####################
 
 
+    # Skip anything this task already evaluated in an earlier run (overlapping windows, retried ticks)
+    links = [meta["link"] for meta in chosen_dict.values() if isinstance(meta, dict) and meta.get("link")]
+    seen = await asyncio.to_thread(cache.get_seen_links, taskid, links)
+    if seen:
+        print(f"=== SKIPPING {len(seen)} ALREADY SEEN ITEMS ===")
+        chosen_dict = {t: meta for t, meta in chosen_dict.items() if not (isinstance(meta, dict) and meta.get("link") in seen)}
+
+    # The same story syndicated by several outlets is only fetched and evaluated once
+    # The other outlets' copies are kept as alternate citations for the report
+    stories = [[(t, chosen_dict[t]) for t in cluster] for cluster in vectors.cluster_titles(list(chosen_dict))]
+
     print()
-    print(f"=== FILTER ROUND TWO ({len(chosen_dict)} ITEMS) ===")
+    print(f"=== FILTER ROUND TWO ({len(chosen_dict)} ITEMS, {len(stories)} STORIES) ===")
     print()
 
-    # Google News is annoying. This gets the actual URL instead of Google's redirect
-    def resolve_url(url: str) -> str:
-        try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
-                page = browser.new_page()
-                try:
-                    page.goto(url, wait_until="domcontentloaded", timeout=7000)
-                    try:
-                        page.wait_for_load_state("networkidle", timeout=5000)
-                    except Exception:
-                        pass
-                    final_url = page.evaluate("window.location.href")
-                except Exception as e:
-                    final_url = f"ERROR: navigation failed ({e})"
-                browser.close()
-                return final_url
-        except PlaywrightError as e:
-            return f"ERROR: Playwright failed ({e})"
-        except Exception as e:
-            return f"ERROR: unexpected failure ({e})"
-
-    # Gets the content of the webpage
-    def get_main_content(url: str) -> str:
-        try:
-            final_url = resolve_url(url)
-            if final_url.startswith("ERROR:"):
-                return final_url
-
-            article = Article(final_url)
-            article.download()
-            article.parse()
-            return article.text
-        except Exception as e:
-            return f"ERROR: failed to get main content ({e})"
+    # Gets the content of the webpage (the URL must already be resolved)
+    # Shared with every other task through the article store, so each article is only downloaded once
+    async def get_main_content(url: str) -> str:
+        if url.startswith("ERROR:"):
+            return url
+        return await cache.get_or_fetch_article(url, download_article)
 
     eval_tools = [
         {
@@ -431,36 +607,48 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
         }
     ]
 
-    # Cap max items to 30 of them
+    # Cap max stories to 30 of them
     # Pick a random sample so that they aren't all from the same search
-    if len(chosen_dict) > 30:
-        chosen_dict = dict(random.sample(list(chosen_dict.items()), 30))
-
-    passed_items = []
+    left_over = len(stories) > 30
+    if left_over:
+        stories = random.sample(stories, 30)
+
+    # Evaluates one story: resolve, download, then the LLM relevance call
+    # The first copy of the story that can be downloaded is the one evaluated
+    # Returns ([item, link, date, reason, alternates] or None, links of the story that got a verdict)
+    async def evaluate_item(members):
+        for item, meta in members:
+            print(f"=== ITEM ===\n{item}")
+
+            if isinstance(meta, dict):
+                date = meta.get("published", None)
+                link = meta.get("link", None)
+            else:
+                date = None
+                link = None
 
-    for item, meta in chosen_dict.items():
-        print(f"=== ITEM ===")
-        print(item)
+            # Skip if there's no valid link
+            if not link:
+                continue
 
-        if isinstance(meta, dict):
-            date = meta.get("published", None)
-            link = meta.get("link", None)
-        else:
-            date = None
-            link = None
+            link = await resolve_url_async(link)
 
-        # Skip if there's no valid link
-        if not link:
-            continue
+            content = (await get_main_content(link))[:3000]
 
-        link = resolve_url(link)
+            # Article is empty or a stub
+            if (len(content) < 200):
+                print(f"! Item is very short or empty !")
+                continue
 
-        content = get_main_content(link)[:3000]
+            break
+        else:
+            return None, []
 
-        # Article is empty or a stub
-        if (len(content) < 200):
-            print(f"! Item is very short or empty !")
-            continue
+        alternates = [
+            {"title": t, "link": m["link"]}
+            for t, m in members
+            if t != item and isinstance(m, dict) and m.get("link")
+        ]
 
         messages = [
             {
@@ -528,7 +716,11 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
                 """
             }
         ]
-        _, tool_name, tool_contents = chat(messages, eval_tools, True)
+        _, tool_name, tool_contents = await chat_async(messages, eval_tools, True)
+
+        # The story got a verdict, so no later run needs to look at any copy of it again
+        # (only recorded once the verdict is actually read below)
+        story_links = [m["link"] for _, m in members if isinstance(m, dict) and m.get("link")]
 
         # Handle tool calling issues
         parsed = None
@@ -547,14 +739,60 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
 
         # If the AI marked the item as relevant, add to list
         if parsed and isinstance(parsed, dict) and parsed.get("relevant") == True:
-            passed_items.append([item, link, date, parsed.get("reason", "")])
-            print("! ITEM PASSED !")
-        else:
-            print("! ITEM FAILED !")
+            print(f"! ITEM PASSED: {item} !")
+            return [item, link, date, parsed.get("reason", ""), alternates], story_links
 
-        # We don't need more than this!
-        if len(passed_items) >= 10:
-            break
+        print(f"! ITEM FAILED: {item} !")
+        return None, story_links
+
+    passed_items = []
+    pending = deque()
+    items = iter(stories)
+
+    # Keep a bounded number of items in flight, but read the results back in order
+    # That way the 10 items that pass are always the same ones the old serial loop would have kept
+    def submit_next():
+        for members in items:
+            pending.append(asyncio.ensure_future(evaluate_item(members)))
+            return
+
+    for _ in range(SECOND_FILTER_CONCURRENCY):
+        submit_next()
+
+    try:
+        while pending:
+            future = pending.popleft()
+            try:
+                result, story_links = await future
+            except Exception as e:
+                print(f"! ITEM ERRORED ({e}) !")
+                result, story_links = None, []
+
+            # Only verdicts we actually read count as seen; anything dropped past the cap stays unseen
+            # Passed stories are only seen once they're stored, or a failed write would lose them for good
+            if result and passed_links is not None:
+                passed_links.extend(story_links)
+            elif story_links:
+                await asyncio.to_thread(cache.mark_seen, taskid, story_links)
+
+            if result:
+                passed_items.append(result)
+
+            # We don't need more than this!
+            if len(passed_items) >= 10:
+                break
+
+            submit_next()
+    finally:
+        # Stop everything still in flight (also if this whole task gets cancelled)
+        for future in pending:
+            future.cancel()
+
+    # Stories that never got a verdict must come back next time, so the next poll can't be answered with a 304
+    left_over = left_over or bool(pending) or next(items, None) is not None
+    if left_over and feed_states:
+        for row in feed_states:
+            row.update(etag=None, modified=None)
 
     return passed_items
 
@@ -564,7 +802,7 @@ def refresh_data(user_query: str, searches: list, last_time: datetime):
 #####################
 
 
-def create_report(user_query: str, vetted_items: dict, last_report: datetime):
+def build_report_messages(user_query: str, vetted_items: dict, last_report: datetime):
     """
     user_query: The query from the user.
     vetted_items: All items that got past both filters.
@@ -575,10 +813,13 @@ def create_report(user_query: str, vetted_items: dict, last_report: datetime):
 
     def create_content_str(items):
         full = ""
-        for name, link, date, reason in items:
+        for name, link, date, reason, alternates in items:
             full += f"=== ITEM NAME ===\n{name}\n"
             full += f"=== ITEM LINK (To cite) ===\n{link}\n"
             full += f"=== ITEM DATE ===\n{date}\n"
+            if alternates:
+                full += "=== SAME STORY FROM OTHER OUTLETS (Can also cite) ===\n"
+                full += "".join(f"{a['title']}: {a['link']}\n" for a in alternates)
             full += f"=== ITEM INFO (LLM generated) ===\n{reason}\n\n"
         return full
 
@@ -613,8 +854,19 @@ def create_report(user_query: str, vetted_items: dict, last_report: datetime):
         Remember, 750 words MINIMUM.
         """}
     ]
-    message, _, _ = chat(report_messages)
+    return report_messages
+
+
+def create_report(user_query: str, vetted_items: dict, last_report: datetime):
+    message, _, _ = chat(build_report_messages(user_query, vetted_items, last_report))
 
     message = markdown.markdown(message)
 
-    return message
\ No newline at end of file
+    return message
+
+
+async def create_report_async(user_query: str, vetted_items: dict, last_report: datetime):
+    message, _, _ = await chat_async(build_report_messages(user_query, vetted_items, last_report))
+
+    # Markdown rendering is CPU-bound, keep it off the event loop
+    return await asyncio.to_thread(markdown.markdown, message)
@@ -0,0 +1,48 @@
+from collections import defaultdict
+import threading
+
+# Process-wide counters (cache hits/misses, etc.) exposed through GET /metrics
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+
+def observe(name: str, ms: float):
+    """
+    name: What was timed.
+    ms: How long it took, in milliseconds.
+    """
+    with _lock:
+        timing = _timings[name]
+        timing["count"] += 1
+        timing["total_ms"] += ms
+        timing["max_ms"] = max(timing["max_ms"], ms)
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters[name]
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {"count": t["count"], "avg_ms": round(t["total_ms"] / t["count"], 1), "max_ms": round(t["max_ms"], 1)}
+            for name, t in _timings.items() if t["count"]
+        }
+
+    # Hit rate of every cache that counts `<name>.hit` and `<name>.miss`
+    hit_rates = {}
+    for name in {key.rsplit(".", 1)[0] for key in counters if key.endswith((".hit", ".miss"))}:
+        hits, misses = counters.get(f"{name}.hit", 0), counters.get(f"{name}.miss", 0)
+        if hits + misses:
+            hit_rates[name] = round(hits / (hits + misses), 4)
+
+    return {"counters": counters, "hit_rates": hit_rates, "timings": timings}
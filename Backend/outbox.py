@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, update
+import asyncio
+import random
+import os
+
+from Backend.database.db import SessionLocal
+from Backend.database import models
+from Backend import mail, metrics
+
+# Messages sent at once, and how many are claimed per round
+MAIL_CONCURRENCY = int(os.getenv("MAIL_CONCURRENCY", "4"))
+MAIL_BATCH = int(os.getenv("MAIL_BATCH", "20"))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "2"))
+
+# Failed sends are retried with exponential backoff, then given up on
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_BACKOFF_BASE = float(os.getenv("MAIL_BACKOFF_BASE", "30"))
+MAIL_BACKOFF_MAX = float(os.getenv("MAIL_BACKOFF_MAX", "3600"))
+
+# A message stuck in "sending" this long is from a sender that died, and is tried again
+MAIL_LEASE_SECONDS = int(os.getenv("MAIL_LEASE_SECONDS", "300"))
+
+# Sent and failed messages are kept this long
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "30"))
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+table = models.Outbox
+
+
+def message(to: str, subject: str, body: str, kind: str) -> dict:
+    """
+    Returns a new outbox row. Add it in the same transaction as whatever the email is about,
+    so the email is queued if and only if that commits.
+    """
+    now = datetime.now()
+    return {
+        "kind": kind,
+        "to": to,
+        "subject": subject,
+        "body": body,
+        "status": QUEUED,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created": now,
+    }
+
+
+def claim(limit: int) -> list:
+    """
+    Takes up to `limit` messages that are due. Returns `(id, to, subject, body, attempts)` for each.
+    """
+    now = datetime.now()
+    # For a message being sent, `next_attempt_at` is when its lease runs out
+    due = and_(table.status.in_([QUEUED, SENDING]), table.next_attempt_at <= now)
+
+    with SessionLocal() as db:
+        candidates = [
+            id for (id,) in db.query(table.id)
+            .filter(due)
+            .order_by(table.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ]
+        if not candidates:
+            return []
+
+        # Same conditional claim as the cron queue, so two senders never take the same message
+        claimed = db.execute(
+            update(table)
+            .where(table.id.in_(candidates))
+            .where(due)
+            .values(status=SENDING, next_attempt_at=now + timedelta(seconds=MAIL_LEASE_SECONDS), attempts=table.attempts + 1)
+            .returning(table.id, table.to, table.subject, table.body, table.attempts)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.commit()
+
+    return [tuple(row) for row in claimed]
+
+
+def backoff(attempts: int) -> float:
+    delay = min(MAIL_BACKOFF_MAX, MAIL_BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def finish(id: int, attempts: int, error: str = None):
+    now = datetime.now()
+
+    if error is None:
+        values = {"status": SENT, "sent": now, "last_error": None}
+    elif attempts >= MAIL_MAX_ATTEMPTS:
+        values = {"status": FAILED, "last_error": error}
+    else:
+        values = {"status": QUEUED, "next_attempt_at": now + timedelta(seconds=backoff(attempts)), "last_error": error}
+
+    with SessionLocal() as db:
+        db.execute(update(table).where(table.id == id).values(**values).execution_options(synchronize_session=False))
+        db.commit()
+
+
+async def send_one(row, limit: asyncio.Semaphore):
+    id, to, subject, body, attempts = row
+
+    async with limit:
+        try:
+            await asyncio.to_thread(mail.get_transport().send, to, subject, body)
+            error = None
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+    if error is None:
+        metrics.incr("mail.sent")
+    elif attempts >= MAIL_MAX_ATTEMPTS:
+        print(f"Giving up on email {id} to {to}: {error}")
+        metrics.incr("mail.failed")
+    else:
+        print(f"Email {id} to {to} failed ({error}), retrying")
+        metrics.incr("mail.retries")
+
+    await asyncio.to_thread(finish, id, attempts, error)
+
+
+async def send_pending(batch: int = MAIL_BATCH, concurrency: int = MAIL_CONCURRENCY) -> int:
+    """
+    Sends one batch of due messages. Returns how many were claimed.
+    """
+    rows = await asyncio.to_thread(claim, batch)
+    if rows:
+        limit = asyncio.Semaphore(max(1, concurrency))
+        await asyncio.gather(*(send_one(row, limit) for row in rows))
+    return len(rows)
+
+
+async def run(stop: asyncio.Event):
+    """
+    Sends queued messages until `stop` is set.
+    """
+    while not stop.is_set():
+        try:
+            sent = await send_pending()
+        except Exception as e:
+            print(f"Outbox sender failed: {e}")
+            sent = 0
+
+        if sent:
+            continue
+
+        try:
+            await asyncio.wait_for(stop.wait(), MAIL_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def prune_outbox():
+    cutoff = datetime.now() - timedelta(days=OUTBOX_RETENTION_DAYS)
+    with SessionLocal() as db:
+        db.query(table).filter(table.status.in_([SENT, FAILED]), table.created < cutoff).delete(synchronize_session=False)
+        db.commit()
@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+import multiprocessing
+import threading
+import os
+
+from Backend import metrics
+
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+
+# argon2 is meant to be slow and memory-hungry, so it gets its own processes instead of
+# sharing the API's threads (and GIL) with every other request
+HASH_PROCESSES = int(os.getenv("HASH_PROCESSES", str(os.cpu_count() or 1)))
+
+# Hashes waiting or running at once. Past this, logins and signups get a 429 instead of piling up
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(HASH_PROCESSES * 4)))
+
+# How long a request waits for its hash before giving up
+HASH_TIMEOUT_SECONDS = float(os.getenv("HASH_TIMEOUT_SECONDS", "10"))
+
+
+class Overloaded(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(HASH_MAX_PENDING)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the API process has threads (the pipeline loop, DB pools) that a fork would copy mid-use
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, HASH_PROCESSES),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def start():
+    # Start the processes now, so the first login doesn't pay for it
+    for future in [get_executor().submit(_hash, "warmup") for _ in range(max(1, HASH_PROCESSES))]:
+        future.result()
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def _discard(executor: ProcessPoolExecutor):
+    # A hashing process died (argon2's memory use makes the OOM killer a real possibility) and took the
+    # pool with it. Drop it so the next call starts a new one, instead of every login failing until a restart
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+    metrics.incr("passwords.broken_pool")
+
+
+def _run(fn, *args):
+    if not _pending.acquire(blocking=False):
+        metrics.incr("passwords.rejected")
+        raise Overloaded("Too many logins at once, try again in a moment.")
+
+    executor = get_executor()
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _pending.release()
+        _discard(executor)
+        raise Overloaded("Logins are restarting, try again in a moment.")
+    except Exception:
+        _pending.release()
+        raise
+
+    # The slot is freed when the hash is actually finished (or cancelled), not when the caller
+    # stops waiting, so the limit counts what's really queued or running in the pool
+    future.add_done_callback(lambda _: _pending.release())
+
+    try:
+        return future.result(timeout=HASH_TIMEOUT_SECONDS)
+    except TimeoutError:
+        # Drop it from the queue if it hasn't started yet, so the pool doesn't spend its time on abandoned requests
+        future.cancel()
+        metrics.incr("passwords.timeouts")
+        raise Overloaded("Logins are taking too long right now, try again in a moment.")
+    except BrokenProcessPool:
+        _discard(executor)
+        raise Overloaded("Logins are restarting, try again in a moment.")
+
+
+def hash_password(password) -> str:
+    if not isinstance(password, str):
+        password = str(password)
+    return _run(_hash, password)
+
+
+def verify_password(plain_password, hashed_password) -> bool:
+    return _run(_verify, plain_password, hashed_password)
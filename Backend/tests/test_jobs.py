@@ -0,0 +1,112 @@
+"""
+Lease semantics of the cron job queue, against a throwaway SQLite database.
+
+    python -m pytest Backend/tests
+
+Set TEST_DATABASE_URL to run them against another (throwaway!) database instead.
+DATABASE_URL is ignored, since the tests empty the job queue.
+"""
+from datetime import datetime, timedelta
+import tempfile
+import os
+
+# The engine is created on import, so the URL has to be set first
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'jobs.db')}"
+
+import pytest
+
+from Backend.database.db import Base, SessionLocal, engine
+from Backend.database import models
+from Backend import jobs
+
+
+@pytest.fixture(autouse=True)
+def fresh_queue():
+    if engine.url.render_as_string(hide_password=False) != os.environ["DATABASE_URL"]:
+        pytest.exit("The engine was created before the test database was set up")
+
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        if db.query(models.Task).first() or db.query(models.Users).first():
+            pytest.exit("The test database has users or tasks in it, point TEST_DATABASE_URL at a throwaway database")
+
+        db.query(models.CronJobs).delete()
+        db.commit()
+    yield
+
+
+def job(taskid: int) -> models.CronJobs:
+    with SessionLocal() as db:
+        return db.get(models.CronJobs, taskid)
+
+
+def expire_lease(taskid: int):
+    # What a worker that died mid-batch leaves behind
+    with SessionLocal() as db:
+        db.get(models.CronJobs, taskid).lease_expires = datetime.now() - timedelta(seconds=1)
+        db.commit()
+
+
+def test_two_workers_never_claim_the_same_job():
+    assert jobs.enqueue([1, 2, 3, 4]) == 4
+
+    first = jobs.claim("w1", 2)
+    second = jobs.claim("w2", 10)
+
+    assert len(first) == 2
+    assert sorted(first + second) == [1, 2, 3, 4]
+    assert jobs.claim("w3", 10) == []
+    assert jobs.counts() == {jobs.RUNNING: 4}
+
+
+def test_enqueue_skips_jobs_that_are_queued_or_running():
+    jobs.enqueue([1, 2])
+    jobs.claim("w1", 1)
+
+    assert jobs.enqueue([1, 2, 3]) == 1
+    assert jobs.counts() == {jobs.RUNNING: 1, jobs.QUEUED: 2}
+
+
+def test_expired_lease_is_claimed_by_another_worker():
+    jobs.enqueue([1])
+    assert jobs.claim("w1", 1) == [1]
+    assert jobs.claim("w2", 1) == []
+
+    expire_lease(1)
+    assert jobs.claim("w2", 1) == [1]
+
+    claimed = job(1)
+    assert claimed.lease_owner == "w2"
+    assert claimed.attempts == 2
+
+    # The first worker can't keep a lease it lost
+    assert jobs.renew("w1", [1]) == 0
+    assert jobs.renew("w2", [1]) == 1
+
+
+def test_complete_from_a_worker_that_lost_its_lease_is_ignored():
+    jobs.enqueue([1])
+    jobs.claim("w1", 1)
+    expire_lease(1)
+    jobs.claim("w2", 1)
+
+    jobs.complete("w1", {1: {"id": 1, "status": "error"}})
+    assert job(1).status == jobs.RUNNING
+    assert job(1).lease_owner == "w2"
+
+    jobs.complete("w2", {1: {"id": 1, "status": "ok"}})
+    finished = job(1)
+    assert finished.status == jobs.DONE
+    assert finished.lease_owner is None
+    assert finished.result == {"id": 1, "status": "ok"}
+
+
+def test_failed_and_finished_jobs_can_be_queued_again():
+    jobs.enqueue([1, 2])
+    jobs.claim("w1", 2)
+    jobs.complete("w1", {1: {"id": 1, "status": "ok"}, 2: {"id": 2, "status": "error"}})
+    assert jobs.counts() == {jobs.DONE: 1, jobs.FAILED: 1}
+
+    assert jobs.enqueue([1, 2]) == 2
+    assert sorted(jobs.claim("w2", 10)) == [1, 2]
+    assert job(1).attempts == 1
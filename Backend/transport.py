@@ -0,0 +1,108 @@
+from requests.adapters import HTTPAdapter
+import requests
+import asyncio
+import random
+import httpx
+import time
+import os
+
+from Backend import metrics
+
+# Shared HTTP transport for every LLM provider call
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "90"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+
+# Rate limited or a provider-side failure, worth trying again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Keep-alive connection pool, so calls after the first skip the TLS handshake
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE))
+
+# Same pool settings for SDKs that take an httpx client (Cerebras)
+httpx_client = httpx.Client(
+    timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+)
+
+# Async client for the pipeline loop (see Backend/aio.py)
+async_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+)
+
+
+def backoff(attempt: int, retry_after: str = None) -> float:
+    """
+    attempt: How many attempts already failed (starting at 0).
+    Exponential backoff with full jitter, unless the server told us how long to wait.
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+def post_json(url: str, payload: dict, headers: dict = None) -> dict:
+    """
+    url: The endpoint to POST to.
+    payload: JSON body.
+    Retries connection errors, timeouts, 429s and 5xx responses. Raises once retries run out.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        last_try = attempt == LLM_MAX_RETRIES
+        try:
+            response = session.post(
+                url,
+                json=payload,
+                headers=headers,
+                timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if last_try:
+                raise
+            metrics.incr("llm.retries")
+            print(f"LLM request failed ({e}), retrying")
+            time.sleep(backoff(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and not last_try:
+            metrics.incr("llm.retries")
+            print(f"LLM request returned {response.status_code}, retrying")
+            time.sleep(backoff(attempt, response.headers.get("Retry-After")))
+            continue
+
+        response.raise_for_status()
+        return response.json()
+
+
+async def post_json_async(url: str, payload: dict, headers: dict = None) -> dict:
+    """
+    Same as `post_json`, for the async pipeline.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        last_try = attempt == LLM_MAX_RETRIES
+        try:
+            response = await async_client.post(url, json=payload, headers=headers)
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            if last_try:
+                raise
+            metrics.incr("llm.retries")
+            print(f"LLM request failed ({e}), retrying")
+            await asyncio.sleep(backoff(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and not last_try:
+            metrics.incr("llm.retries")
+            print(f"LLM request returned {response.status_code}, retrying")
+            await asyncio.sleep(backoff(attempt, response.headers.get("Retry-After")))
+            continue
+
+        response.raise_for_status()
+        return response.json()
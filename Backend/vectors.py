@@ -0,0 +1,172 @@
+import numpy as np
+import zlib
+import re
+import os
+
+# Local, CPU-only text embeddings for comparing headlines against a task.
+#
+# There is no embedding model in our dependencies, so text is embedded with the
+# hashing trick: words, word pairs and character n-grams are hashed into a fixed
+# number of dimensions. The character n-grams make related word forms
+# ("regulation" / "regulators") land close together. Everything is L2-normalized,
+# so a dot product is the cosine similarity.
+
+EMBED_DIM = int(os.getenv("EMBED_DIM", "1024"))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "how", "i",
+    "in", "into", "is", "it", "its", "me", "my", "new", "news", "of", "on", "or", "over", "says",
+    "that", "the", "their", "this", "to", "want", "was", "what", "when", "where", "which", "who",
+    "will", "with", "about", "after", "any", "there", "notified", "know", "if", "up", "you",
+}
+
+_word_re = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list:
+    return [w for w in _word_re.findall(text.lower()) if w not in STOPWORDS]
+
+
+def _features(text: str):
+    words = tokenize(text)
+
+    for w in words:
+        yield "w:" + w, 1.0
+
+        # Character n-grams of the padded word
+        padded = f"<{w}>"
+        for i in range(len(padded) - 3):
+            yield "c:" + padded[i:i + 4], 0.3
+
+    for a, b in zip(words, words[1:]):
+        yield f"b:{a} {b}", 0.7
+
+
+def embed(texts: list, dim: int = EMBED_DIM) -> np.ndarray:
+    """
+    texts: The strings to embed.
+    Returns a (len(texts), dim) float32 matrix of unit-length rows.
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+
+    for row, text in enumerate(texts):
+        for feature, weight in _features(text):
+            # crc32 is stable across processes (unlike hash()), so stored vectors stay valid
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            matrix[row, h % dim] += sign * weight
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similarity(queries: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    queries: (q, dim) matrix from `embed`.
+    candidates: (n, dim) matrix from `embed`.
+    Returns the best cosine similarity of each candidate against any of the queries, shape (n,).
+    """
+    if len(queries) == 0 or len(candidates) == 0:
+        return np.zeros(len(candidates), dtype=np.float32)
+    return (candidates @ queries.T).max(axis=1)
+
+
+def to_bytes(matrix: np.ndarray) -> bytes:
+    return matrix.astype(np.float32).tobytes()
+
+
+def from_bytes(data: bytes, dim: int = EMBED_DIM) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, dim)
+
+
+# Matching an LLM-retyped title back to the RSS title it came from
+TITLE_MATCH_CUTOFF = float(os.getenv("TITLE_MATCH_CUTOFF", "0.5"))
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(_word_re.findall(title.lower()))
+
+
+class TitleIndex:
+    """
+    Built once per refresh over every RSS title.
+
+    Titles the model copied exactly (ignoring case, punctuation and spacing) are found
+    with a dict lookup. Everything else is embedded in one batch and compared against
+    all of the RSS titles with a single matrix product.
+    """
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        self._exact = {}
+        for title in self.titles:
+            self._exact.setdefault(normalize_title(title), title)
+        self._matrix = None
+
+    def _vectors(self) -> np.ndarray:
+        # Only embedded if some title wasn't an exact match
+        if self._matrix is None:
+            self._matrix = embed(self.titles)
+        return self._matrix
+
+    def match_many(self, queries: list, cutoff: float = TITLE_MATCH_CUTOFF) -> list:
+        """
+        queries: Titles as written by the model.
+        Returns the matching RSS title (or None) for each query, in order.
+        """
+        results = [self._exact.get(normalize_title(q)) for q in queries]
+
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing and self.titles:
+            scores = embed([queries[i] for i in missing]) @ self._vectors().T
+            best = scores.argmax(axis=1)
+            for row, i in enumerate(missing):
+                if scores[row, best[row]] >= cutoff:
+                    results[i] = self.titles[best[row]]
+
+        return results
+
+    def match(self, query: str, cutoff: float = TITLE_MATCH_CUTOFF):
+        return self.match_many([query], cutoff)[0]
+
+
+# Titles of the same story from different outlets with at least this much word overlap are grouped together
+CLUSTER_THRESHOLD = float(os.getenv("CLUSTER_THRESHOLD", "0.5"))
+
+
+def _title_shingles(title: str) -> set:
+    # Google News titles end in " - Outlet Name", which says nothing about the story itself
+    if " - " in title:
+        title = title.rsplit(" - ", 1)[0]
+    return set(tokenize(title))
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def cluster_titles(titles: list, threshold: float = CLUSTER_THRESHOLD) -> list:
+    """
+    titles: Headlines, in order of preference.
+    Groups near-duplicate headlines (the same story syndicated by several outlets).
+    Returns a list of clusters, each a list of titles. Clusters and the titles inside them keep the input order.
+    """
+    clusters = []
+    shingles = []
+
+    for title in titles:
+        s = _title_shingles(title)
+
+        for members, member_shingles in zip(clusters, shingles):
+            if any(jaccard(s, m) >= threshold for m in member_shingles):
+                members.append(title)
+                member_shingles.append(s)
+                break
+        else:
+            clusters.append([title])
+            shingles.append([s])
+
+    return clusters
@@ -0,0 +1,172 @@
+import multiprocessing
+import argparse
+import asyncio
+import socket
+import uuid
+import time
+import os
+
+from Backend import cron, jobs, cache, feeds, outbox, aio
+
+# Jobs claimed at once by one worker (they run CRON_CONCURRENCY at a time, like a tick used to)
+WORKER_BATCH = int(os.getenv("WORKER_BATCH", str(cron.CRON_CONCURRENCY * 2)))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "5"))
+PRUNE_INTERVAL_SECONDS = int(os.getenv("PRUNE_INTERVAL_SECONDS", "600"))
+
+# Batches a worker runs within this long of each other share one feed registry, so tasks with
+# the same searches still share fetches across the whole tick and not only within one batch
+FEED_SHARE_SECONDS = float(os.getenv("FEED_SHARE_SECONDS", "300"))
+
+# Also run a worker inside the API process, so a single uvicorn process still does all the work
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "1") == "1"
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+async def heartbeat(owner: str, task_ids: list):
+    # Keep the leases alive for as long as the batch runs
+    while True:
+        await asyncio.sleep(jobs.CRON_LEASE_SECONDS / 3)
+        held = await asyncio.to_thread(jobs.renew, owner, task_ids)
+        if held < len(task_ids):
+            print(f"Worker {owner} lost {len(task_ids) - held} leases")
+
+
+async def work_once(owner: str, batch: int = WORKER_BATCH, registry: feeds.FeedRegistry = None) -> int:
+    """
+    owner: Name of this worker.
+    registry: Feed registry shared with the worker's other batches of the same tick.
+    Claims one batch of jobs and runs it. Returns how many jobs were claimed.
+    """
+    claimed = await asyncio.to_thread(jobs.claim, owner, batch)
+    if not claimed:
+        return 0
+
+    print(f"=== WORKER {owner} CLAIMED {len(claimed)} TASKS ===")
+    tasks = await asyncio.to_thread(jobs.load_tasks, claimed)
+
+    beat = asyncio.ensure_future(heartbeat(owner, claimed))
+    try:
+        summaries = await cron.run_tasks_async(tasks, registry=registry)
+    finally:
+        beat.cancel()
+
+    # Tasks deleted since they were queued just get marked done
+    results = dict.fromkeys(claimed)
+    results.update({summary["id"]: summary for summary in summaries})
+    await asyncio.to_thread(jobs.complete, owner, results)
+    return len(claimed)
+
+
+def prune():
+    try:
+        cache.prune()
+        feeds.prune_feed_states()
+        outbox.prune_outbox()
+    except Exception as e:
+        print(f"Cache pruning failed: {e}")
+
+
+async def work(owner: str = None, stop: asyncio.Event = None):
+    """
+    owner: Name of this worker (made up if not given).
+    stop: Set it to stop after the current batch.
+    Runs queued jobs until stopped, polling when the queue is empty.
+    """
+    owner = owner or worker_name()
+    stop = stop or asyncio.Event()
+    last_prune = 0.0
+    registry = None
+    registry_started = 0.0
+    print(f"Worker {owner} started")
+
+    # Every worker also sends queued emails
+    sender = asyncio.ensure_future(outbox.run(stop))
+
+    while not stop.is_set():
+        # A tick's tasks are queued together, so they're claimed in back-to-back batches
+        if registry and time.monotonic() - registry_started >= FEED_SHARE_SECONDS:
+            cron.report_feeds(registry)
+            registry = None
+        if registry is None:
+            registry = feeds.FeedRegistry()
+            registry_started = time.monotonic()
+
+        try:
+            claimed = await work_once(owner, registry=registry)
+        except Exception as e:
+            print(f"Worker {owner} failed to run a batch: {e}")
+            claimed = 0
+
+        if claimed:
+            continue
+
+        # Queue is drained, so the tick is over: its feeds shouldn't be reused, and it's a good time for housekeeping
+        if registry.requested:
+            cron.report_feeds(registry)
+        registry = None
+
+        if time.monotonic() - last_prune >= PRUNE_INTERVAL_SECONDS:
+            await asyncio.to_thread(prune)
+            last_prune = time.monotonic()
+
+        try:
+            await asyncio.wait_for(stop.wait(), WORKER_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+    await sender
+    print(f"Worker {owner} stopped")
+
+
+class EmbeddedWorker:
+    """
+    A worker running on the pipeline loop of the API process.
+    """
+
+    def __init__(self):
+        self._stop = None
+        self._future = None
+
+    def start(self):
+        loop = aio.get_loop()
+
+        async def create_stop():
+            return asyncio.Event()
+
+        self._stop = aio.run(create_stop())
+        self._future = asyncio.run_coroutine_threadsafe(work(stop=self._stop), loop)
+
+    def stop(self, timeout: float = 30):
+        if not self._future:
+            return
+        aio.get_loop().call_soon_threadsafe(self._stop.set)
+        try:
+            self._future.result(timeout)
+        except Exception as e:
+            print(f"Embedded worker didn't stop cleanly: {e}")
+        self._future = None
+
+
+embedded = EmbeddedWorker()
+
+
+def run_process():
+    aio.run(work())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run cron workers that process queued tasks.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process()
+    else:
+        processes = [multiprocessing.Process(target=run_process) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -62,6 +62,22 @@ export default function ChatPage() {
       .finally(() => setLoading(false));
   }, [backendUrl, token]);
 
+  // New tasks get their searches in the background, so check back until they're ready
+  const generating = tasks.some((task) => task.status === "generating");
+
+  useEffect(() => {
+    if (!token || !generating) return;
+
+    const interval = setInterval(() => {
+      axios
+        .get(`${backendUrl}/get_queries`, authHeaders)
+        .then((res) => setTasks(res.data))
+        .catch((err) => console.error("Error refreshing tasks:", err));
+    }, 3000);
+
+    return () => clearInterval(interval);
+  }, [backendUrl, token, generating]);
+
   const addTask = () => {
     setErrorMessage("");
     if (tasks.length >= 3) {
@@ -146,7 +162,7 @@ export default function ChatPage() {
       authHeaders
     )
     .then((res) => {
-      setTasks(tasks.map((task) => (task.id === id ? res.data : task)));
+      setTasks(tasks.map((task) => (task.id === id ? { ...task, ...res.data } : task)));
       setEditTaskId(null);
     })
     .catch((err) => {
@@ -301,6 +317,14 @@ export default function ChatPage() {
                 <p className="text-gray-400">
                   How often: {displayMap[task.contact]}
                 </p>
+                {task.status === "generating" && (
+                  <p className="text-yellow-400 mt-2">Setting up searches...</p>
+                )}
+                {task.status === "failed" && (
+                  <p className="text-red-500 mt-2">
+                    Couldn't set up searches for this task. Try deleting it and creating it again.
+                  </p>
+                )}
 
                 {editTaskId === task.id && (
                   <div className="bg-gray-900 p-4 mt-4 rounded-lg">